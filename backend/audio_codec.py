@@ -0,0 +1,151 @@
+import ctypes.util
+import math
+from typing import List, Optional
+
+import numpy as np
+
+# Without libopus audio is sent as raw PCM. opuslib raises a bare Exception
+# (not ImportError) when the library is missing, so probe for it first
+opuslib = None
+if ctypes.util.find_library("opus") is not None:
+    try:
+        import opuslib
+    except Exception:
+        opuslib = None
+
+# Rates the Opus encoder accepts; anything else is resampled up to the next one
+OPUS_RATES = (8000, 12000, 16000, 24000, 48000)
+OPUS_FRAME_MS = 20
+OPUS_BITRATE = 32000  # bit/s, plenty for a single speech voice
+# Input samples of context kept on each side of a resampled block; more than
+# the half-width of torchaudio's default sinc filter at any of these ratios
+RESAMPLE_CONTEXT = 64
+
+
+def opus_available() -> bool:
+    return opuslib is not None
+
+
+class _StreamResampler:
+    """Resamples a stream of int16 chunks as if it were one continuous signal.
+
+    Resampling each chunk on its own zero-pads both of its edges, which leaves
+    a click at every chunk boundary. Here the last samples of each chunk are
+    held back until the next one supplies their right-hand context, and the
+    samples before them are kept as left-hand context; blocks are cut on
+    multiples of the reduced input rate so the filter phase lines up.
+    """
+
+    def __init__(self, orig_freq: int, new_freq: int) -> None:
+        import torch
+        import torchaudio
+
+        self._torch = torch
+        self._resample = torchaudio.transforms.Resample(orig_freq=orig_freq, new_freq=new_freq)
+        gcd = math.gcd(orig_freq, new_freq)
+        self._orig, self._new = orig_freq // gcd, new_freq // gcd
+        self._context = self._orig * -(-RESAMPLE_CONTEXT // self._orig)
+        self._reset()
+
+    def _reset(self) -> None:
+        self._history = np.zeros(self._context, dtype=np.float32)
+        self._held = np.zeros(0, dtype=np.float32)
+
+    def _run(self, block: np.ndarray, length: int) -> np.ndarray:
+        """Resample `block` (left context, `length` new samples, right context)
+        and return the output for the new samples only."""
+        out = self._resample(self._torch.from_numpy(block).unsqueeze(0)).squeeze(0).numpy()
+        start = self._context * self._new // self._orig
+        end = start + -(-length * self._new // self._orig)
+        return np.clip(out[start:end], -32768, 32767).astype(np.int16)
+
+    def process(self, audio: np.ndarray) -> np.ndarray:
+        pending = np.concatenate([self._held, audio.astype(np.float32)])
+        ready = (pending.shape[0] - self._context) // self._orig * self._orig
+        if ready <= 0:
+            self._held = pending
+            return np.zeros(0, dtype=np.int16)
+        block = np.concatenate([self._history, pending[:ready + self._context]])
+        out = self._run(block, ready)
+        self._history = block[ready:ready + self._context]
+        self._held = pending[ready:]
+        return out
+
+    def flush(self) -> np.ndarray:
+        """Resample the held samples up to the end of the signal."""
+        length = self._held.shape[0]
+        if length == 0:
+            self._reset()
+            return np.zeros(0, dtype=np.int16)
+        padded = -(-length // self._orig) * self._orig
+        block = np.zeros(self._context + padded + self._context, dtype=np.float32)
+        block[:self._context] = self._history
+        block[self._context:self._context + length] = self._held
+        out = self._run(block, length)
+        self._reset()
+        return out
+
+
+class OpusStream:
+    """Encodes int16 mono chunks into 20 ms Opus packets for one connection.
+
+    Chunks rarely end on a frame boundary, so the remainder is carried into
+    the next chunk; `flush()` pads and encodes it at the end of a reply.
+    """
+
+    def __init__(self, bitrate: int = OPUS_BITRATE) -> None:
+        self.bitrate = bitrate
+        self.input_rate: Optional[int] = None
+        self.rate: Optional[int] = None
+        self._encoder = None
+        self._resampler: Optional[_StreamResampler] = None
+        self._pending = np.zeros(0, dtype=np.int16)
+
+    @property
+    def frame_size(self) -> int:
+        return self.rate * OPUS_FRAME_MS // 1000
+
+    def _configure(self, sample_rate: int) -> None:
+        self.input_rate = sample_rate
+        self.rate = next((r for r in OPUS_RATES if r >= sample_rate), OPUS_RATES[-1])
+        self._encoder = opuslib.Encoder(self.rate, 1, opuslib.APPLICATION_VOIP)
+        self._encoder.bitrate = self.bitrate
+        self._resampler = None
+        if self.rate != sample_rate:
+            self._resampler = _StreamResampler(sample_rate, self.rate)
+        self._pending = np.zeros(0, dtype=np.int16)
+
+    def encode(self, audio: np.ndarray, sample_rate: int) -> List[bytes]:
+        """Encode as many whole frames of `audio` (int16) as are available."""
+        packets: List[bytes] = []
+        if sample_rate != self.input_rate:
+            if self._encoder is not None:
+                packets.extend(self.flush())
+            self._configure(sample_rate)
+
+        if self._resampler is not None:
+            audio = self._resampler.process(audio)
+        packets.extend(self._encode_frames(audio))
+        return packets
+
+    def _encode_frames(self, audio: np.ndarray) -> List[bytes]:
+        pcm = np.concatenate([self._pending, audio]) if self._pending.size else audio
+        frame = self.frame_size
+        whole = pcm.shape[0] - pcm.shape[0] % frame
+        packets = [self._encoder.encode(pcm[i:i + frame].tobytes(), frame) for i in range(0, whole, frame)]
+        self._pending = pcm[whole:].copy()
+        return packets
+
+    def flush(self) -> List[bytes]:
+        """Resample what is still held back, pad the leftover samples with
+        silence and encode them."""
+        if self._encoder is None:
+            return []
+        packets = self._encode_frames(self._resampler.flush()) if self._resampler is not None else []
+        if self._pending.size == 0:
+            return packets
+        frame = np.zeros(self.frame_size, dtype=np.int16)
+        frame[:self._pending.size] = self._pending
+        self._pending = np.zeros(0, dtype=np.int16)
+        packets.append(self._encoder.encode(frame.tobytes(), self.frame_size))
+        return packets
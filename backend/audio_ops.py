@@ -0,0 +1,37 @@
+import numpy as np
+from numba import njit
+
+
+@njit(cache=True, boundscheck=False)
+def ring_write(data: np.ndarray, write: int, mask: int, chunk: np.ndarray) -> int:
+    """Copy `chunk` into the power-of-two ring `data` at stream position `write`.
+
+    Returns the new write position. When the chunk is longer than the ring
+    only its newest `len(data)` samples are kept.
+    """
+    size = data.shape[0]
+    n = chunk.shape[0]
+    skip = n - size if n > size else 0
+    for i in range(skip, n):
+        data[(write + i) & mask] = chunk[i]
+    return write + n
+
+
+@njit(cache=True, boundscheck=False, fastmath=True)
+def frame_energy(frame: np.ndarray) -> float:
+    """Mean square of an audio frame, accumulated in float64."""
+    n = frame.shape[0]
+    if n == 0:
+        return 0.0
+    s = 0.0
+    for i in range(n):
+        s += frame[i] * frame[i]
+    return s / n
+
+
+def warmup() -> None:
+    """Compile the kernels ahead of the first audio frame."""
+    data = np.zeros(8, dtype=np.float32)
+    frame = np.zeros(3, dtype=np.float32)
+    ring_write(data, 0, 7, frame)
+    frame_energy(frame)
@@ -1,52 +1,231 @@
+import asyncio
+import logging
+import os
+from functools import lru_cache
+
 import httpx
-from typing import List, Dict, Optional
+import numpy as np
+import orjson
+from numba import njit
+from typing import AsyncIterator, List, Dict, Optional, Tuple
 from memory import MemoryStore
 
+logger = logging.getLogger(__name__)
+
+
+# Shared HTTP client so every call reuses pooled keep-alive connections
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            timeout=120.0,
+            limits=httpx.Limits(max_connections=200, max_keepalive_connections=100),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+# Micro-batching: requests arriving within the window are sent to Ollama together
+BATCH_WINDOW = 0.008  # seconds
+OLLAMA_NUM_PARALLEL = int(os.environ.get("OLLAMA_NUM_PARALLEL", 4))
+
+
+def _ollama_payload(messages: List[Dict[str, str]], ollama_model: str, stream: bool) -> Dict:
+    return {
+        "model": ollama_model,
+        "messages": messages,
+        "stream": stream,
+        "options": {
+            "temperature": 0.7,
+            "top_p": 0.9,
+            "top_k": 40,
+        }
+    }
+
+
+async def _ollama_request(messages: List[Dict[str, str]], ollama_host: str, ollama_model: str) -> str:
+    # Errors (httpx.HTTPStatusError, transport errors) propagate to the caller
+    response = await get_http_client().post(
+        f"{ollama_host}/api/chat",
+        json=_ollama_payload(messages, ollama_model, stream=False),
+    )
+    response.raise_for_status()
+    data = orjson.loads(response.content)
+    return data.get("message", {}).get("content", "")
+
+
+async def ollama_chat_stream(
+    messages: List[Dict[str, str]], ollama_host: str, ollama_model: str
+) -> AsyncIterator[str]:
+    """Stream the reply from Ollama, yielding content chunks as they are generated."""
+    async with get_http_client().stream(
+        "POST",
+        f"{ollama_host}/api/chat",
+        json=_ollama_payload(messages, ollama_model, stream=True),
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            data = orjson.loads(line)
+            chunk = data.get("message", {}).get("content", "")
+            if chunk:
+                yield chunk
+            if data.get("done"):
+                break
+
+
+class OllamaBatcher:
+    """Coalesces concurrent chat requests into batches for Ollama.
+
+    A background consumer waits `window` seconds after the first queued
+    request, drains up to `max_batch` requests and sends them together so they
+    land in Ollama's parallel slots (OLLAMA_NUM_PARALLEL) at the same time and
+    share prefill/decode steps. At most `max_batch` requests are in flight, so
+    bursts queue here instead of piling up in Ollama.
+    """
+
+    def __init__(self, window: float = BATCH_WINDOW, max_batch: int = OLLAMA_NUM_PARALLEL) -> None:
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self._queue: Optional[asyncio.Queue] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: set = set()
+        # Requests taken off the queue by _run but not yet handed to a dispatch task
+        self._draining: list = []
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue()
+        self._slots = asyncio.Semaphore(self.max_batch)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        for task in list(self._inflight):
+            task.cancel()
+        await asyncio.gather(self._task, *self._inflight, return_exceptions=True)
+        self._task = None
+
+        # Fail the batch _run was still collecting, and anything left in the queue
+        for *_, future in self._draining:
+            if not future.done():
+                future.cancel()
+        self._draining = []
+        while not self._queue.empty():
+            *_, future = self._queue.get_nowait()
+            if not future.done():
+                future.cancel()
+
+    async def submit(self, messages: List[Dict[str, str]], ollama_host: str, ollama_model: str) -> str:
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((messages, ollama_host, ollama_model, future))
+        return await future
+
+    async def _run(self) -> None:
+        while True:
+            first = await self._queue.get()
+            batch = self._draining = [first]
+            await asyncio.sleep(self.window)
+
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            for _ in batch:
+                await self._slots.acquire()
+            self._draining = []
+            task = asyncio.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch: list) -> None:
+        try:
+            results = await asyncio.gather(
+                *(_ollama_request(messages, host, model) for messages, host, model, _ in batch),
+                return_exceptions=True,
+            )
+            for (*_, future), result in zip(batch, results):
+                if future.done():
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+        finally:
+            for *_, future in batch:
+                if not future.done():
+                    future.cancel()
+                self._slots.release()
+
+
+_batcher = OllamaBatcher()
+
+
+def get_batcher() -> OllamaBatcher:
+    return _batcher
+
 
 async def ollama_chat(messages: List[Dict[str, str]], ollama_host: str, ollama_model: str) -> str:
     """Send chat messages to Ollama and return the response."""
-    try:
-        async with httpx.AsyncClient(timeout=120.0) as client:
-            response = await client.post(
-                f"{ollama_host}/api/chat",
-                json={
-                    "model": ollama_model,
-                    "messages": messages,
-                    "stream": False,
-                    "options": {
-                        "temperature": 0.7,
-                        "top_p": 0.9,
-                        "top_k": 40,
-                    }
-                },
-                timeout=120.0
-            )
-            response.raise_for_status()
-            data = response.json()
-            return data.get("message", {}).get("content", "")
-    except httpx.HTTPStatusError as e:
-        print(f"Ollama API error: {e}")
-        raise Exception(f"Error communicating with Ollama: {str(e)}")
+    if _batcher.running:
+        return await _batcher.submit(messages, ollama_host, ollama_model)
+    return await _ollama_request(messages, ollama_host, ollama_model)
 
 
-def build_messages(user_id: str, user_text: str, memory: MemoryStore, system_prompt: str) -> List[Dict[str, str]]:
-    """Build the messages list for the LLM, including system prompt and relevant memories."""
+@lru_cache(maxsize=1024)
+def _compose_memory_block(facts: Tuple[str, ...]) -> str:
+    """Format the memories message; memoized since facts rarely change between turns."""
+    if not facts:
+        return ""
+    return "Memórias relevantes sobre o usuário:\n" + "\n".join(f"- {f}" for f in facts)
+
+
+def build_messages(
+    user_id: str,
+    user_text: str,
+    memory: MemoryStore,
+    system_prompt: str,
+    query_emb: Optional[np.ndarray] = None,
+) -> List[Dict[str, str]]:
+    """Build the messages list for the LLM, including system prompt and relevant memories.
+
+    If `query_emb` (the normalized embedding of `user_text`) is given, memories
+    are ranked by similarity to it instead of by keyword overlap.
+    """
     try:
         # Get relevant facts from memory
-        facts = memory.get_top_facts(user_id=user_id, query=user_text, limit=6)
-        memory_block = "\n".join(f"- {f}" for f in facts) if facts else ""
+        if query_emb is not None:
+            facts = memory.get_top_facts_with_embedding(user_id=user_id, query_emb=query_emb, limit=6)
+        else:
+            facts = memory.get_top_facts(user_id=user_id, query=user_text, limit=6)
+        memory_block = _compose_memory_block(tuple(facts))
 
-        # Build system prompt with memories if available
-        final_system_prompt = system_prompt
+        # Keep the system prompt byte-identical across calls so the LLM server
+        # can reuse its cached prefix; memories go in a separate message.
+        messages = [{"role": "system", "content": system_prompt}]
         if memory_block.strip():
-            final_system_prompt = f"{system_prompt}\n\nMemórias relevantes sobre o usuário:\n{memory_block}"
-
-        return [
-            {"role": "system", "content": final_system_prompt},
-            {"role": "user", "content": user_text},
-        ]
-    except Exception as e:
-        print(f"Error building messages: {e}")
+            messages.append({"role": "system", "content": memory_block})
+        messages.append({"role": "user", "content": user_text})
+        return messages
+    except Exception:
+        logger.exception("Error building messages")
         # Return a basic message structure if there's an error
         return [
             {"role": "system", "content": system_prompt},
@@ -54,53 +233,117 @@ def build_messages(user_id: str, user_text: str, memory: MemoryStore, system_pro
         ]
 
 
+def build_prefix(user_id: str, memory: MemoryStore, system_prompt: str, limit: int = 6) -> List[Dict[str, str]]:
+    """Build the system prompt and memories part of the messages, without the user turn.
+
+    Unlike build_messages the memories are the user's most recent ones rather
+    than those relevant to the current text, so the prefix stays identical
+    from turn to turn (until a fact is added) and can be cached by the caller
+    and by the LLM server's prompt cache.
+    """
+    messages = [{"role": "system", "content": system_prompt}]
+    try:
+        memory_block = _compose_memory_block(tuple(memory.get_recent_facts(user_id, limit)))
+    except Exception:
+        logger.exception("Error building message prefix")
+        return messages
+    if memory_block.strip():
+        messages.append({"role": "system", "content": memory_block})
+    return messages
+
+
+# Statements that introduce a fact about the user
+FACT_PREFIXES = (
+    "meu nome é ",
+    "eu me chamo ",
+    "eu gosto de ",
+    "eu não gosto de ",
+    "minha comida favorita é ",
+    "minha cor favorita é ",
+    "eu moro em ",
+    "eu tenho ",
+    "eu não tenho ",
+    "eu sou ",
+    "eu não sou ",
+    "eu trabalho como ",
+    "eu estudo ",
+    "eu nasci em ",
+    "meu aniversário é ",
+    "eu tenho medo de ",
+    "eu adoro ",
+    "eu odeio ",
+    "eu prefiro ",
+)
+
+# Questions that should never be stored as facts
+QUESTION_PREFIXES = (
+    "quem é ",
+    "o que é ",
+    "qual é ",
+    "quando é ",
+    "onde fica ",
+    "por que ",
+    "como é ",
+)
+
+
+def _pack_prefixes(prefixes: Tuple[str, ...]) -> Tuple[np.ndarray, np.ndarray]:
+    """Pack UTF-8 prefixes into one flat uint8 table plus int32 offsets."""
+    encoded = [p.encode("utf-8") for p in prefixes]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    table = np.frombuffer(b"".join(encoded), dtype=np.uint8).copy()
+    return offsets, table
+
+
+@njit(cache=True, boundscheck=False)
+def _match_prefix(text: np.ndarray, offsets: np.ndarray, table: np.ndarray) -> int:
+    """Index of the first packed prefix `text` starts with, or -1."""
+    n = text.shape[0]
+    for k in range(offsets.shape[0] - 1):
+        start = offsets[k]
+        length = offsets[k + 1] - start
+        if length > n:
+            continue
+        matched = True
+        for j in range(length):
+            if text[j] != table[start + j]:
+                matched = False
+                break
+        if matched:
+            return k
+    return -1
+
+
+# Fact and question prefixes share one table, longest first so the first hit
+# is the longest match; _PREFIX_IS_FACT tells which list a hit came from.
+_PREFIXES = sorted(
+    [(p, True) for p in dict.fromkeys(FACT_PREFIXES)] + [(p, False) for p in dict.fromkeys(QUESTION_PREFIXES)],
+    key=lambda entry: len(entry[0].encode("utf-8")),
+    reverse=True,
+)
+_PREFIX_OFFSETS, _PREFIX_TABLE = _pack_prefixes(tuple(p for p, _ in _PREFIXES))
+_PREFIX_IS_FACT = tuple(is_fact for _, is_fact in _PREFIXES)
+
+
+def warmup_fact_matcher() -> None:
+    """Compile the prefix matcher ahead of the first request."""
+    maybe_extract_fact("eu sou")
+
+
 def maybe_extract_fact(user_text: str) -> Optional[str]:
     """Extract potential facts from user text that should be remembered."""
     t = user_text.strip()
     if not t:
         return None
 
-    lower = t.lower()
-    prefixes = (
-        "meu nome é ",
-        "eu me chamo ",
-        "eu gosto de ",
-        "eu não gosto de ",
-        "minha comida favorita é ",
-        "minha cor favorita é ",
-        "eu moro em ",
-        "eu tenho ",
-        "eu não tenho ",
-        "eu sou ",
-        "eu não sou ",
-        "eu trabalho como ",
-        "eu estudo ",
-        "eu moro em ",
-        "eu nasci em ",
-        "meu aniversário é ",
-        "eu tenho medo de ",
-        "eu adoro ",
-        "eu odeio ",
-        "eu prefiro ",
-    )
-    
-    # Check if the text matches any of the fact patterns
-    if any(lower.startswith(p) for p in prefixes):
-        return t
-        
-    # Also check for question patterns that might indicate a fact
-    question_prefixes = (
-        "quem é ",
-        "o que é ",
-        "qual é ",
-        "quando é ",
-        "onde fica ",
-        "por que ",
-        "como é ",
-    )
-    
-    if any(lower.startswith(p) for p in question_prefixes):
-        return None
+    lower = np.frombuffer(t.lower().encode("utf-8"), dtype=np.uint8)
+
+    # One native pass over the fact and question prefixes
+    hit = _match_prefix(lower, _PREFIX_OFFSETS, _PREFIX_TABLE)
+    if hit >= 0:
+        # Statement of a fact, or a question that should never be stored
+        return t if _PREFIX_IS_FACT[hit] else None
         
     # If the text is a short statement, it might be a fact
     if len(t.split()) <= 15 and t.endswith(('.', '!', '?')):
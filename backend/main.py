@@ -2,20 +2,25 @@ import asyncio
 import json
 import os
 import logging
+import time
 from typing import Any, Dict, Optional, List
 
 import httpx
 import uvicorn
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, Response
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
 from pydantic_settings import BaseSettings
 
 from memory import MemoryStore
+from semantic_cache import SemanticCache, cache_scope, get_embedder
+from vector_ops import warmup as warmup_vector_ops
+from audio_ops import warmup as warmup_audio_ops
 from stt import SpeechToText, get_stt
 from tts import TTSEngine, get_tts
+from model_pool import run_model, shutdown_model_pool
 from websocket_handler import VTuberWebSocketHandler
 
 # Configure logging
@@ -38,6 +43,7 @@ class Settings(BaseSettings):
     
     # Database
     memory_db_path: str = os.environ.get("MEMORY_DB_PATH", os.path.join(os.path.dirname(__file__), "memory.sqlite3"))
+    semantic_cache_db_path: str = os.environ.get("SEMANTIC_CACHE_DB_PATH", os.path.join(os.path.dirname(__file__), "semantic_cache.sqlite3"))
     
     # Nathy Configuration
     system_prompt: str = os.environ.get(
@@ -63,6 +69,17 @@ from contextlib import asynccontextmanager
 async def lifespan(app: FastAPI):
     """Initialize and cleanup components."""
     logger.info("Starting VTuber 3D Offline backend...")
+    get_batcher().start()
+
+    # Pay the Numba compile cost here instead of on the first user request
+    warmup_vector_ops()
+    warmup_audio_ops()
+    warmup_fact_matcher()
+    # First synthesis initializes the voice's inference session; the short
+    # greeting it leaves in the TTS cache is a common first sentence anyway
+    await run_model(tts_engine.synthesize, "Oi!")
+    # Load the embedding model and run it once so /api/chat doesn't pay for it
+    await run_model(get_embedder().embed, "Oi!")
     
     # Check if Ollama is running
     ollama_ok = await check_ollama_connection()
@@ -75,12 +92,21 @@ async def lifespan(app: FastAPI):
     logger.info("Backend ready!")
     yield
 
+    semantic_cache.save()
+    semantic_cache.close()
+    await get_batcher().stop()
+    await close_http_client()
+    await close_openai_client()
+    shutdown_model_pool()
+    memory.close()
+
 # Initialize FastAPI app
 app = FastAPI(
     title="VTuber 3D Offline",
     description="Backend for offline 3D VTuber with voice interaction",
     version="0.1.0",
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Add CORS middleware
@@ -94,12 +120,17 @@ app.add_middleware(
 
 # Initialize components
 memory = MemoryStore(settings.memory_db_path)
+semantic_cache = SemanticCache(settings.semantic_cache_db_path)
 stt_engine = get_stt()
 tts_engine = get_tts()
-ws_handler = VTuberWebSocketHandler(stt_engine, tts_engine, memory, settings.ollama_host, settings.ollama_model, settings.system_prompt, settings.llm_provider)
+
+# Main page, read once so each GET returns the same encoded bytes
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+with open(os.path.join(STATIC_DIR, "index.html"), "rb") as f:
+    INDEX_HTML_BYTES = f.read()
 
 # Mount static files (for the web interface if needed)
-app.mount("/static", StaticFiles(directory="static"), name="static")
+app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 
 class ChatRequest(BaseModel):
@@ -115,8 +146,8 @@ class VoiceSettings(BaseModel):
     volume: Optional[float] = None
 
 
-from llm_utils import ollama_chat, build_messages, maybe_extract_fact
-from openai_utils import openai_chat
+from llm_utils import ollama_chat, build_messages, maybe_extract_fact, get_http_client, close_http_client, get_batcher, warmup_fact_matcher
+from openai_utils import openai_chat, close_openai_client
 
 
 @app.get("/ping")
@@ -124,240 +155,56 @@ async def ping():
     """Health check endpoint para manter awake no Render."""
     return {"status": "awake", "service": "nathy-vtuber"}
 
-@app.get("/", response_class=HTMLResponse)
+@app.get("/")
 async def read_root():
     """Serve the main HTML page."""
-    return """
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <title>VTuber 3D Offline</title>
-        <style>
-            body {
-                font-family: Arial, sans-serif;
-                max-width: 800px;
-                margin: 0 auto;
-                padding: 20px;
-                text-align: center;
-            }
-            .container {
-                margin-top: 50px;
-            }
-            .status {
-                margin: 20px 0;
-                padding: 10px;
-                border-radius: 5px;
-            }
-            .listening {
-                background-color: #d4edda;
-                color: #155724;
-            }
-            .idle {
-                background-color: #f8f9fa;
-                color: #6c757d;
-            }
-            button {
-                padding: 10px 20px;
-                font-size: 16px;
-                margin: 10px;
-                cursor: pointer;
-            }
-            #transcript {
-                margin: 20px 0;
-                padding: 15px;
-                border: 1px solid #ddd;
-                min-height: 100px;
-                text-align: left;
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <h1>VTuber 3D Offline</h1>
-            <div id="status" class="status idle">Status: Desconectado</div>
-            <div>
-                <button id="connectBtn">Conectar</button>
-                <button id="listenBtn" disabled>Ouvir</button>
-                <button id="stopBtn" disabled>Parar</button>
-            </div>
-            <div id="transcript"></div>
-            <div id="response"></div>
-        </div>
-        <script>
-            let ws;
-            const connectBtn = document.getElementById('connectBtn');
-            const listenBtn = document.getElementById('listenBtn');
-            const stopBtn = document.getElementById('stopBtn');
-            const statusDiv = document.getElementById('status');
-            const transcriptDiv = document.getElementById('transcript');
-            const responseDiv = document.getElementById('response');
-            
-            function updateStatus(text, isListening = false) {
-                statusDiv.textContent = `Status: ${text}`;
-                statusDiv.className = `status ${isListening ? 'listening' : 'idle'}`;
-            }
-            
-            function appendToTranscript(text, isUser = true) {
-                const p = document.createElement('p');
-                p.textContent = text;
-                p.style.color = isUser ? 'blue' : 'green';
-                p.style.margin = '5px 0';
-                p.style.padding = '5px';
-                p.style.borderLeft = `4px solid ${isUser ? 'blue' : 'green'}`;
-                transcriptDiv.appendChild(p);
-                transcriptDiv.scrollTop = transcriptDiv.scrollHeight;
-            }
-            
-            function connectWebSocket() {
-                const wsProtocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
-                const wsUrl = `${wsProtocol}//${window.location.host}/ws`;
-                
-                console.log('Tentando conectar WebSocket:', wsUrl);
-                
-                ws = new WebSocket(wsUrl);
-                
-                ws.onopen = () => {
-                    console.log('WebSocket conectado!');
-                    updateStatus('Conectado');
-                    connectBtn.disabled = true;
-                    listenBtn.disabled = false;
-                    stopBtn.disabled = false;
-                    
-                    // Send initial hello message with user ID
-                    ws.send(JSON.stringify({
-                        type: 'hello',
-                        user_id: 'user_1'
-                    }));
-                };
-                
-                ws.onmessage = (event) => {
-                    try {
-                        // Handle binary audio data
-                        if (event.data instanceof ArrayBuffer) {
-                            const int16Array = new Int16Array(event.data);
-                            playAudio(int16Array);
-                            return;
-                        }
-                        
-                        // Handle JSON messages
-                        const data = JSON.parse(event.data);
-                        console.log('Message from server:', data);
-                        
-                        if (data.type === 'user_speech') {
-                            appendToTranscript(`Você: ${data.text}`, true);
-                        } else if (data.type === 'assistant_text') {
-                            appendToTranscript(`VTuber: ${data.text}`, false);
-                        } else if (data.type === 'status') {
-                            updateStatus(data.status === 'listening' ? 'Ouvindo...' : 'Pronto', data.status === 'listening');
-                        } else if (data.type === 'error') {
-                            console.error('Error:', data.message);
-                            alert(`Erro: ${data.message}`);
-                        }
-                    } catch (e) {
-                        console.error('Error parsing message:', e);
-                    }
-                };
-                
-                ws.onclose = () => {
-                    console.log('WebSocket fechado');
-                    updateStatus('Desconectado');
-                    connectBtn.disabled = false;
-                    listenBtn.disabled = true;
-                    stopBtn.disabled = true;
-                    
-                    // Try to reconnect after 3 seconds
-                    setTimeout(() => connectWebSocket(), 3000);
-                };
-                
-                ws.onerror = (error) => {
-                    console.error('WebSocket error:', error);
-                    updateStatus('Erro de conexão');
-                };
-            }
-            
-            # Button event listeners
-            connectBtn.addEventListener('click', connectWebSocket);
-            
-            listenBtn.addEventListener('click', () => {
-                if (ws && ws.readyState === WebSocket.OPEN) {
-                    ws.send(JSON.stringify({ type: 'start_listening' }));
-                }
-            });
-            
-            stopBtn.addEventListener('click', () => {
-                if (ws && ws.readyState === WebSocket.OPEN) {
-                    ws.send(JSON.stringify({ type: 'stop_listening' }));
-                }
-            });
-            
-            // Audio context for playing VTuber voice
-            let audioContext = null;
-            let currentAudio = null;
-            
-            function initAudioContext() {
-                if (!audioContext) {
-                    audioContext = new (window.AudioContext || window.webkitAudioContext)();
-                }
-            }
-            
-            function playAudio(int16Array) {
-                initAudioContext();
-                
-                // Convert Int16Array to Float32Array for Web Audio API
-                const float32Array = new Float32Array(int16Array.length);
-                for (let i = 0; i < int16Array.length; i++) {
-                    float32Array[i] = int16Array[i] / 32768.0;
-                }
-                
-                // Create audio buffer
-                const audioBuffer = audioContext.createBuffer(1, float32Array.length, 22050);
-                audioBuffer.copyToChannel(float32Array, 0);
-                
-                // Stop current audio if playing
-                if (currentAudio) {
-                    currentAudio.stop();
-                }
-                
-                // Create and play new audio source
-                currentAudio = audioContext.createBufferSource();
-                currentAudio.buffer = audioBuffer;
-                currentAudio.connect(audioContext.destination);
-                currentAudio.start();
-                
-                currentAudio.onended = () => {
-                    currentAudio = null;
-                };
-            }
-            
-            // Connect automatically when the page loads
-            connectWebSocket();
-        </script>
-    </body>
-    </html>
-    """
+    return Response(content=INDEX_HTML_BYTES, media_type="text/html", headers={"Cache-Control": "public, max-age=3600"})
 
 @app.post("/api/chat")
 async def chat_endpoint(req: ChatRequest) -> Dict[str, Any]:
     """Handle chat messages via HTTP POST."""
     try:
+        # Embed the user text once; it is reused for memory ranking, the
+        # stored fact and the semantic cache lookup
+        query_emb = await run_model(get_embedder().embed, req.text)
+
         # Extract and store facts if applicable
         fact = maybe_extract_fact(req.text)
         if fact:
-            memory.add_fact(user_id=req.user_id, fact=fact)
+            await asyncio.to_thread(memory.add_fact, req.user_id, fact, query_emb)
+
+        messages = await asyncio.to_thread(build_messages, req.user_id, req.text, memory, settings.system_prompt, query_emb)
+
+        # Reuse a cached reply for a similar question in the same context
+        scope = cache_scope(req.user_id, messages)
+        reply = semantic_cache.lookup(scope, query_emb)
+        if reply is not None:
+            return {"reply": reply}
 
         # Get response from LLM
-        messages = build_messages(req.user_id, req.text, memory, settings.system_prompt)
         reply = await ollama_chat(messages, settings.ollama_host, settings.ollama_model)
+        semantic_cache.add(scope, query_emb, reply)
         
         return {"reply": reply}
+    except httpx.HTTPStatusError:
+        raise
     except Exception as e:
         logger.error(f"Error in chat endpoint: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.exception_handler(httpx.HTTPStatusError)
+async def ollama_error_handler(request: Request, exc: httpx.HTTPStatusError):
+    """Translate upstream LLM HTTP errors into a 502 response."""
+    logger.error(f"Ollama API error: {exc}")
+    return ORJSONResponse(status_code=502, content={"detail": f"Error communicating with Ollama: {exc}"})
+
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     """Handle WebSocket connections for real-time voice interaction."""
+    # One handler per connection: it owns that client's audio buffer, VAD and ASR tasks
+    ws_handler = VTuberWebSocketHandler(stt_engine, tts_engine, memory, settings.ollama_host, settings.ollama_model, settings.system_prompt, settings.llm_provider)
     await ws_handler.connect(websocket)
 
 @app.get("/api/status")
@@ -370,16 +217,27 @@ async def get_status():
         "tts_ready": True,
     }
 
+# Seconds to reuse the last Ollama reachability result
+OLLAMA_CHECK_TTL = 5.0
+_last_ollama_check = [0.0, False]  # [monotonic timestamp, result]
+
+
 async def check_ollama_connection() -> bool:
-    """Check if the Ollama server is reachable."""
+    """Check if the Ollama server is reachable (cached for OLLAMA_CHECK_TTL seconds)."""
+    now = time.monotonic()
+    if _last_ollama_check[0] and now - _last_ollama_check[0] < OLLAMA_CHECK_TTL:
+        return _last_ollama_check[1]
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(f"{settings.ollama_host}/api/tags")
-            response.raise_for_status()
-            return True
+        response = await get_http_client().get(f"{settings.ollama_host}/api/tags")
+        response.raise_for_status()
+        ok = True
     except Exception as e:
         logger.warning(f"Ollama connection check failed: {e}")
-        return False
+        ok = False
+
+    _last_ollama_check[0], _last_ollama_check[1] = now, ok
+    return ok
 
 @app.post("/api/update_system_prompt")
 async def update_system_prompt(update: SystemPromptUpdate):
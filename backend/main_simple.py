@@ -1,143 +1,195 @@
-from fastapi import FastAPI, WebSocket
-from fastapi.responses import HTMLResponse
-import json
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import Response
+import asyncio
+import hashlib
+import orjson
 import re
-from datetime import datetime
+import threading
+import time
+from collections import deque
+from random import choice as _rand_choice
 
 # Simple knowledge base for the VTuber
+KNOWLEDGE_BASE = {
+    "greetings": {
+        "patterns": [r"oi", r"olá", r"hello", r"bom dia", r"boa tarde", r"boa noite"],
+        "responses": [
+            "Olá! Sou sua VTuber assistente! Como posso ajudar?",
+            "Oi! Que bom conversar com você!",
+            "Olá! Estou aqui para conversar com você!"
+        ]
+    },
+    "how_are_you": {
+        "patterns": [r"como vai", r"como esta", r"tudo bem", r"como voce esta"],
+        "responses": [
+            "Estou ótima! Pronta para conversar e aprender com você!",
+            "Tudo bem por aqui! E você, como está?",
+            "Estou funcionando perfeitamente! Obrigada por perguntar!"
+        ]
+    },
+    "what_are_you": {
+        "patterns": [r"quem e voce", r"o que e voce", r"voce e", r"vtuber"],
+        "responses": [
+            "Sou uma VTuber assistente! Estou aqui para conversar e aprender.",
+            "Sou uma VTuber virtual criada para interagir com você!",
+            "Sou sua assistente VTuber! Posso conversar e aprender coisas novas."
+        ]
+    },
+    "thanks": {
+        "patterns": [r"obrigado", r"obrigada", r"valeu", r"agradec"],
+        "responses": [
+            "De nada! Fico feliz em ajudar!",
+            "Por nada! Sempre que precisar, estou aqui!",
+            "Imagina! É um prazer conversar com você!"
+        ]
+    },
+    "bye": {
+        "patterns": [r"tchau", r"adeus", r"ate logo", r"ate mais"],
+        "responses": [
+            "Tchau! Foi ótimo conversar com você!",
+            "Até logo! Volte sempre!",
+            "Tchau! Tenha um ótimo dia!"
+        ]
+    }
+}
+
+# All categories fused into one regex; the match's lastgroup names the
+# category. Each branch is a lookahead over the whole input, so categories
+# keep their priority order regardless of where in the text they appear.
+_DISPATCH_RE = re.compile(
+    "|".join(
+        f"(?=.*?(?P<{category}>{'|'.join(data['patterns'])}))"
+        for category, data in KNOWLEDGE_BASE.items()
+    ),
+    re.DOTALL,
+)
+
+# Patterns are compiled once at import instead of on every chat turn
+_LEARNING_RE = re.compile("|".join([
+    r"eu sou", r"meu nome e", r"eu moro", r"eu gosto", r"eu nao gosto",
+    r"saiba que", r"aprenda que", r"lembre que", r"eu trabalho", r"eu estudo"
+]))
+
+_FACT_QUESTION_RE = re.compile("|".join([
+    r"voce lembra", r"voce sabe", r"eu ja falei", r"eu ja disse"
+]))
+
+# Matched against the casefolded input, so no IGNORECASE
+_FACT_EXTRACT = [(re.compile(pattern), fact_type) for pattern, fact_type in {
+    r"meu nome e (\w+)": "nome",
+    r"eu moro em ([\w\s]+)": "morada",
+    r"eu gosto de ([\w\s]+)": "gosta",
+    r"eu trabalho como ([\w\s]+)": "trabalho",
+    r"eu estudo ([\w\s]+)": "estudo"
+}.items()]
+
+DEFAULT_RESPONSES = [
+    "Isso é interessante! Pode me contar mais?",
+    "Hmm, estou aprendendo sobre isso. O que você acha?",
+    "Legal! Não sei muito sobre isso, mas estou curiosa para aprender!",
+    "Que interessante! Você pode me ensinar mais sobre isso?",
+    "Estou processando isso... Pode explicar de outra forma?"
+]
+
+# At least one of these occurs in every knowledge, learning and
+# fact-question pattern above; update them together
+_PATTERN_HINTS = (
+    "oi", "olá", "hello", "bom dia", "boa ", "como ", "tudo bem", "voce", "vtuber",
+    "obrigad", "valeu", "agradec", "tchau", "adeus", "ate ", "eu ", "saiba", "aprenda", "lembre",
+)
+
+# Answer templates per fact type, in priority order
+FACT_ANSWERS = {
+    "nome": "Sim! Seu nome é {}, certo?",
+    "trabalho": "Claro! Você trabalha como {}.",
+    "gosta": "Sim! Você gosta de {}.",
+}
+
+_FACT_LOOKUP_RE = re.compile("|".join(re.escape(k) for k in FACT_ANSWERS))
+
 class VTuberBrain:
     def __init__(self):
-        self.knowledge = {
-            "greetings": {
-                "patterns": [r"oi", r"olá", r"hello", r"bom dia", r"boa tarde", r"boa noite"],
-                "responses": [
-                    "Olá! Sou sua VTuber assistente! Como posso ajudar?",
-                    "Oi! Que bom conversar com você!",
-                    "Olá! Estou aqui para conversar com você!"
-                ]
-            },
-            "how_are_you": {
-                "patterns": [r"como vai", r"como esta", r"tudo bem", r"como voce esta"],
-                "responses": [
-                    "Estou ótima! Pronta para conversar e aprender com você!",
-                    "Tudo bem por aqui! E você, como está?",
-                    "Estou funcionando perfeitamente! Obrigada por perguntar!"
-                ]
-            },
-            "what_are_you": {
-                "patterns": [r"quem e voce", r"o que e voce", r"voce e", r"vtuber"],
-                "responses": [
-                    "Sou uma VTuber assistente! Estou aqui para conversar e aprender.",
-                    "Sou uma VTuber virtual criada para interagir com você!",
-                    "Sou sua assistente VTuber! Posso conversar e aprender coisas novas."
-                ]
-            },
-            "thanks": {
-                "patterns": [r"obrigado", r"obrigada", r"valeu", r"agradec"],
-                "responses": [
-                    "De nada! Fico feliz em ajudar!",
-                    "Por nada! Sempre que precisar, estou aqui!",
-                    "Imagina! É um prazer conversar com você!"
-                ]
-            },
-            "bye": {
-                "patterns": [r"tchau", r"adeus", r"ate logo", r"ate mais"],
-                "responses": [
-                    "Tchau! Foi ótimo conversar com você!",
-                    "Até logo! Volte sempre!",
-                    "Tchau! Tenha um ótimo dia!"
-                ]
-            }
-        }
+        self.knowledge = KNOWLEDGE_BASE
         self.user_facts = {}  # Store facts learned from user
-        self.conversation_history = []  # Keep track of conversation
+        self.conversation_history = deque(maxlen=1000)  # Keep track of the latest messages
+        # get_response runs in worker threads; deque.append is atomic, the
+        # facts dict is guarded explicitly
+        self._facts_lock = threading.Lock()
     
     def get_response(self, user_input, user_id="default"):
-        user_input_lower = user_input.lower()
+        # Casefolded once; every pattern below runs on this text
+        user_input_lower = user_input.casefold()
         
         # Store in conversation history
         self.conversation_history.append({
-            "timestamp": datetime.now(),
+            "timestamp": time.time_ns(),
             "user_id": user_id,
             "message": user_input
         })
         
+        # Cheap substring prefilter: every pattern below contains one of the
+        # hints, so plain chitchat skips the regexes entirely
+        if not any(hint in user_input_lower for hint in _PATTERN_HINTS):
+            return _rand_choice(DEFAULT_RESPONSES)
+        
         # Check for learning patterns
         if self._is_learning_pattern(user_input_lower):
-            return self._learn_from_user(user_input)
+            return self._learn_from_user(user_input_lower, user_input)
         
         # Check knowledge base
-        for category, data in self.knowledge.items():
-            for pattern in data["patterns"]:
-                if re.search(pattern, user_input_lower):
-                    return self._get_random_response(data["responses"])
+        match = _DISPATCH_RE.match(user_input_lower)
+        if match:
+            return _rand_choice(self.knowledge[match.lastgroup]["responses"])
         
         # Check if user is asking about learned facts
         if self._is_fact_question(user_input_lower):
             return self._answer_fact_question(user_input_lower)
         
-        # Default responses
-        default_responses = [
-            "Isso é interessante! Pode me contar mais?",
-            "Hmm, estou aprendendo sobre isso. O que você acha?",
-            "Legal! Não sei muito sobre isso, mas estou curiosa para aprender!",
-            "Que interessante! Você pode me ensinar mais sobre isso?",
-            "Estou processando isso... Pode explicar de outra forma?"
-        ]
-        
-        return self._get_random_response(default_responses)
+        return _rand_choice(DEFAULT_RESPONSES)
     
     def _is_learning_pattern(self, text):
-        learning_patterns = [
-            r"eu sou", r"meu nome e", r"eu moro", r"eu gosto", r"eu nao gosto",
-            r"saiba que", r"aprenda que", r"lembre que", r"eu trabalho", r"eu estudo"
-        ]
-        return any(re.search(pattern, text) for pattern in learning_patterns)
+        return _LEARNING_RE.search(text) is not None
     
-    def _learn_from_user(self, text):
+    def _learn_from_user(self, text_lower, original=None):
         # Extract and store facts
-        fact_patterns = {
-            r"meu nome e (\w+)": "nome",
-            r"eu moro em ([\w\s]+)": "morada", 
-            r"eu gosto de ([\w\s]+)": "gosta",
-            r"eu trabalho como ([\w\s]+)": "trabalho",
-            r"eu estudo ([\w\s]+)": "estudo"
-        }
-        
-        for pattern, fact_type in fact_patterns.items():
-            match = re.search(pattern, text, re.IGNORECASE)
+        for pattern, fact_type in _FACT_EXTRACT:
+            match = pattern.search(text_lower)
             if match:
-                fact_value = match.group(1).strip()
-                self.user_facts[fact_type] = fact_value
+                # Keep the user's capitalization when casefolding kept offsets aligned
+                if original is not None and len(original) == len(text_lower):
+                    fact_value = original[match.start(1):match.end(1)].strip()
+                else:
+                    fact_value = match.group(1).strip()
+                with self._facts_lock:
+                    self.user_facts[fact_type] = fact_value
                 return f"Entendido! Vou lembrar que você {fact_type} é {fact_value}. Obrigada por me ensinar!"
         
         return "Obrigada por compartilhar isso comigo! Estou aprendendo cada vez mais."
     
     def _is_fact_question(self, text):
-        question_patterns = [
-            r"voce lembra", r"voce sabe", r"eu ja falei", r"eu ja disse"
-        ]
-        return any(re.search(pattern, text) for pattern in question_patterns)
+        return _FACT_QUESTION_RE.search(text) is not None
     
     def _answer_fact_question(self, text):
-        if "nome" in text and "nome" in self.user_facts:
-            return f"Sim! Seu nome é {self.user_facts['nome']}, certo?"
-        elif "trabalho" in text and "trabalho" in self.user_facts:
-            return f"Claro! Você trabalha como {self.user_facts['trabalho']}."
-        elif "gosta" in text and "gosta" in self.user_facts:
-            return f"Sim! Você gosta de {self.user_facts['gosta']}."
+        mentioned = set(_FACT_LOOKUP_RE.findall(text))
+        with self._facts_lock:
+            facts = dict(self.user_facts)
+        for fact_type, template in FACT_ANSWERS.items():
+            if fact_type in mentioned and fact_type in facts:
+                return template.format(facts[fact_type])
         
         return "Hmm, não me lembro disso... Pode me lembrar novamente?"
-    
-    def _get_random_response(self, responses):
-        import random
-        return random.choice(responses)
 
 # Initialize VTuber brain
 vtuber_brain = VTuberBrain()
 
 app = FastAPI()
 
+
+def _dumps(payload) -> str:
+    # orjson encodes straight to UTF-8; frames stay text so the page's
+    # JSON.parse(event.data) keeps working
+    return orjson.dumps(payload).decode("utf-8")
+
 html = """
 <!DOCTYPE html>
 <html>
@@ -263,47 +315,80 @@ html = """
 </html>
 """
 
+# Encoded once; browsers revalidate with the ETag and get a bodyless 304
+_HTML_BYTES = html.encode("utf-8")
+_ETAG = '"' + hashlib.blake2b(_HTML_BYTES, digest_size=8).hexdigest() + '"'
+_HTML_HEADERS = {"ETag": _ETAG, "Cache-Control": "public, max-age=3600"}
+
 @app.get("/")
-async def get():
-    return HTMLResponse(html)
+async def get(request: Request):
+    if request.headers.get("if-none-match") == _ETAG:
+        return Response(status_code=304, headers=_HTML_HEADERS)
+    return Response(content=_HTML_BYTES, media_type="text/html", headers=_HTML_HEADERS)
+
+# Frames waiting to be sent to one client before its receive loop blocks
+SEND_QUEUE_SIZE = 64
+
+# Running sender tasks; the event loop only keeps weak references to tasks
+_senders: set = set()
+
+async def _drain(websocket: WebSocket, out_q: asyncio.Queue):
+    """Send queued frames in order, so the receive loop never waits on a slow client."""
+    while True:
+        frame = await out_q.get()
+        await websocket.send_text(frame)
+
+def _sender_done(task: asyncio.Task):
+    _senders.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Erro ao enviar: {task.exception()}")
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     print("VTuber WebSocket conectado!")
     
+    out_q: asyncio.Queue = asyncio.Queue(maxsize=SEND_QUEUE_SIZE)
+    sender = asyncio.create_task(_drain(websocket, out_q))
+    _senders.add(sender)
+    sender.add_done_callback(_sender_done)
+    
     try:
         while True:
             try:
                 data = await websocket.receive_text()
+                if sender.done():
+                    # Nothing would drain the queue any more
+                    break
                 print(f"Recebido: {data}")
                 
                 # Parse message
                 try:
-                    message = json.loads(data)
+                    message = orjson.loads(data)
                     msg_type = message.get("type", "")
                     
                     if msg_type == "hello":
                         # Welcome message
-                        await websocket.send_text(json.dumps({
+                        await out_q.put(_dumps({
                             "type": "welcome",
                             "message": "Olá! Eu sou sua VTuber assistente!"
                         }))
                     elif msg_type == "chat":
                         # Simple chat response
                         user_text = message.get("text", "")
-                        response = vtuber_brain.get_response(user_text, "user_1")
-                        await websocket.send_text(json.dumps({
+                        # Off the event loop so other sessions keep flowing
+                        response = await asyncio.to_thread(vtuber_brain.get_response, user_text, "user_1")
+                        await out_q.put(_dumps({
                             "type": "response",
                             "message": response
                         }))
                     else:
                         # Echo for unknown messages
-                        await websocket.send_text(data)
+                        await out_q.put(data)
                         
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     # Simple echo for non-JSON
-                    await websocket.send_text(data)
+                    await out_q.put(data)
                 
             except Exception as e:
                 print(f"Erro no loop: {e}")
@@ -312,6 +397,8 @@ async def websocket_endpoint(websocket: WebSocket):
     except Exception as e:
         print(f"Erro WebSocket: {e}")
     finally:
+        sender.cancel()
+        await asyncio.gather(sender, return_exceptions=True)
         print("VTuber WebSocket desconectado")
 
 if __name__ == "__main__":
@@ -1,7 +1,53 @@
+import hashlib
+import re
 import sqlite3
+import threading
 from dataclasses import dataclass
-from datetime import datetime
-from typing import List
+from typing import List, Optional
+
+import numpy as np
+from cachetools import TTLCache
+
+from vector_ops import cosine_scores_int8, encode_embedding, is_embedding_blob, load_quantized
+
+# Retries of the same message within this window reuse the previous lookup
+FACTS_CACHE_SIZE = 2048
+FACTS_CACHE_TTL = 60  # seconds
+
+# Minimum cosine similarity for a fact to count as relevant to the query
+MIN_FACT_SIMILARITY = 0.3
+
+# Runs of word characters; \w already covers accented letters
+_TOKEN_RE = re.compile(r"\w+")
+
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+
+# Statements are kept as constants so sqlite3's statement cache reuses the
+# prepared form on every call
+# created_at is filled in by SQLite (UTC, same text format as before); it is
+# spelled out rather than left to the column default so older tables work too
+_NOW_UTC = "strftime('%Y-%m-%dT%H:%M:%S', 'now')"
+_INSERT_FACT = f"INSERT INTO facts(user_id, fact, created_at, embedding) VALUES (?, ?, {_NOW_UTC}, ?)"
+_SELECT_RECENT_FACTS = "SELECT fact FROM facts WHERE user_id = ? ORDER BY id DESC LIMIT ?"
+_SEARCH_FACTS = (
+    "SELECT fact FROM facts_fts WHERE facts_fts MATCH ? AND user_id = ? "
+    "ORDER BY bm25(facts_fts), rowid DESC"
+)
+_SELECT_RECENT_EMBEDDINGS = "SELECT fact, embedding FROM facts WHERE user_id = ? ORDER BY id DESC LIMIT 200"
+
+
+def open_db(db_path: str) -> sqlite3.Connection:
+    """Open a long-lived autocommit connection in WAL mode.
+
+    The connection may be used from worker threads (`asyncio.to_thread`);
+    callers serialize access themselves.
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None, cached_statements=64)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    conn.execute("PRAGMA temp_store=MEMORY;")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE};")
+    return conn
 
 
 @dataclass(frozen=True)
@@ -13,76 +59,156 @@ class FactRow:
 class MemoryStore:
     def __init__(self, db_path: str) -> None:
         self.db_path = db_path
+        self._facts_cache: TTLCache = TTLCache(maxsize=FACTS_CACHE_SIZE, ttl=FACTS_CACHE_TTL)
+        # Bumped on every add_fact so cached lookups for that user go stale
+        self._generation: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.conn = open_db(db_path)
         self._init_db()
 
-    def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self.db_path)
-        conn.execute("PRAGMA journal_mode=WAL;")
-        conn.execute("PRAGMA synchronous=NORMAL;")
-        return conn
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
 
     def _init_db(self) -> None:
-        with self._connect() as conn:
+        conn = self.conn
+        with self._lock:
             conn.execute(
                 """
                 CREATE TABLE IF NOT EXISTS facts (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    id INTEGER PRIMARY KEY,
                     user_id TEXT NOT NULL,
                     fact TEXT NOT NULL,
-                    created_at TEXT NOT NULL
+                    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S', 'now'))
+                );
+                """
+            )
+            # Serves the per-user "latest N facts" scans without a sort; it also
+            # covers plain user_id lookups, so the old single-column index goes
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_facts_user_id_desc ON facts(user_id, id DESC);")
+            conn.execute("DROP INDEX IF EXISTS idx_facts_user;")
+
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(facts);")}
+            if "embedding" not in columns:
+                conn.execute("ALTER TABLE facts ADD COLUMN embedding BLOB;")
+
+            # Full-text index over the facts, kept in sync by triggers
+            has_fts = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'facts_fts';"
+            ).fetchone()
+            conn.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS facts_fts USING fts5(
+                    fact, user_id UNINDEXED, content='facts', content_rowid='id'
                 );
                 """
             )
-            conn.execute("CREATE INDEX IF NOT EXISTS idx_facts_user ON facts(user_id);")
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS facts_ai AFTER INSERT ON facts BEGIN
+                    INSERT INTO facts_fts(rowid, fact, user_id) VALUES (new.id, new.fact, new.user_id);
+                END;
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS facts_ad AFTER DELETE ON facts BEGIN
+                    INSERT INTO facts_fts(facts_fts, rowid, fact, user_id) VALUES ('delete', old.id, old.fact, old.user_id);
+                END;
+                """
+            )
+            if not has_fts:
+                conn.execute("INSERT INTO facts_fts(facts_fts) VALUES ('rebuild');")
 
-    def add_fact(self, user_id: str, fact: str) -> None:
+    def add_fact(self, user_id: str, fact: str, embedding: Optional[np.ndarray] = None) -> None:
         fact_clean = (fact or "").strip()
         if not fact_clean:
             return
 
-        created_at = datetime.utcnow().isoformat(timespec="seconds")
-        with self._connect() as conn:
-            conn.execute(
-                "INSERT INTO facts(user_id, fact, created_at) VALUES (?, ?, ?)",
-                (user_id, fact_clean, created_at),
-            )
+        blob = encode_embedding(embedding) if embedding is not None else None
+        with self._lock:
+            self.conn.execute(_INSERT_FACT, (user_id, fact_clean, blob))
+            self._generation[user_id] = self._generation.get(user_id, 0) + 1
+
+    def generation(self, user_id: str) -> int:
+        """Counter bumped whenever a fact is added for `user_id`."""
+        with self._lock:
+            return self._generation.get(user_id, 0)
+
+    def get_recent_facts(self, user_id: str, limit: int = 6) -> List[str]:
+        with self._lock:
+            rows = self.conn.execute(_SELECT_RECENT_FACTS, (user_id, limit)).fetchall()
+        return [str(fact) for (fact,) in rows]
 
     def get_top_facts(self, user_id: str, query: str, limit: int = 6) -> List[str]:
+        digest = hashlib.blake2b((query or "").encode("utf-8"), digest_size=8).digest()
+        with self._lock:
+            key = (user_id, self._generation.get(user_id, 0), limit, digest)
+            cached = self._facts_cache.get(key)
+        if cached is None:
+            cached = self._query_top_facts(user_id, query, limit)
+            with self._lock:
+                self._facts_cache[key] = cached
+        return list(cached)
+
+    def _query_top_facts(self, user_id: str, query: str, limit: int) -> List[str]:
         q = (query or "").strip().lower()
-        tokens = [t for t in _tokenize(q) if len(t) >= 3]
-
-        with self._connect() as conn:
-            rows = conn.execute(
-                "SELECT fact, created_at FROM facts WHERE user_id = ? ORDER BY id DESC LIMIT 200",
-                (user_id,),
-            ).fetchall()
-
-        scored: list[tuple[int, str]] = []
-        for fact, created_at in rows:
-            fact_l = str(fact).lower()
-            score = 0
-            for t in tokens:
-                if t in fact_l:
-                    score += 1
-            if score > 0:
-                scored.append((score, str(fact)))
-
-        scored.sort(key=lambda x: x[0], reverse=True)
+        tokens = {t for t in _tokenize(q) if len(t) >= 3}
+
+        out: list[str] = []
+        with self._lock:
+            if tokens:
+                # Prefix terms keep partial-word matches ("pizz" finds "pizzaria")
+                match = " OR ".join(f'"{t}"*' for t in sorted(tokens))
+                seen = set()
+                for (fact,) in self.conn.execute(_SEARCH_FACTS, (match, user_id)):
+                    f = str(fact)
+                    if f in seen:
+                        continue
+                    seen.add(f)
+                    out.append(f)
+                    if len(out) >= limit:
+                        break
+
+            if out:
+                return out
+
+            rows = self.conn.execute(_SELECT_RECENT_FACTS, (user_id, min(limit, 3))).fetchall()
+        return [str(fact) for (fact,) in rows]
+
+    def get_top_facts_with_embedding(self, user_id: str, query_emb: np.ndarray, limit: int = 6) -> List[str]:
+        """Rank facts by cosine similarity to a precomputed, normalized query embedding.
+
+        Facts stored without an embedding are only used for the recent-facts
+        fallback.
+        """
+        q = np.ascontiguousarray(query_emb, dtype=np.float32)
+
+        with self._lock:
+            rows = self.conn.execute(_SELECT_RECENT_EMBEDDINGS, (user_id,)).fetchall()
+
+        embedded = [(str(fact), blob) for fact, blob in rows if is_embedding_blob(blob, q.shape[0])]
         out: list[str] = []
         seen = set()
-        for _, f in scored:
-            if f in seen:
-                continue
-            seen.add(f)
-            out.append(f)
-            if len(out) >= limit:
-                break
+        if embedded:
+            matrix, scales = load_quantized([blob for _, blob in embedded], q.shape[0])
+            sims = cosine_scores_int8(matrix, scales, q)
+            for i in np.argsort(-sims, kind="stable"):
+                if sims[i] < MIN_FACT_SIMILARITY:
+                    break
+                f = embedded[i][0]
+                if f in seen:
+                    continue
+                seen.add(f)
+                out.append(f)
+                if len(out) >= limit:
+                    break
 
         if out:
             return out
 
         out2: list[str] = []
-        for fact, _created_at in rows:
+        for fact, _embedding in rows:
             f = str(fact)
             if f not in seen:
                 out2.append(f)
@@ -92,15 +218,4 @@ class MemoryStore:
 
 
 def _tokenize(text: str) -> List[str]:
-    buff: list[str] = []
-    cur: list[str] = []
-    for ch in text:
-        if ch.isalnum() or ch in "_áàâãéèêíìîóòôõúùûç":
-            cur.append(ch)
-        else:
-            if cur:
-                buff.append("".join(cur))
-                cur.clear()
-    if cur:
-        buff.append("".join(cur))
-    return buff
+    return _TOKEN_RE.findall(text)
@@ -0,0 +1,34 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Optional, TypeVar
+
+T = TypeVar("T")
+
+# Whisper and TTS calls are hundreds of ms of CPU/GPU work each; running
+# more than a couple at once only makes them contend for the same cores
+MODEL_WORKERS = 2
+
+_model_pool: Optional[ThreadPoolExecutor] = None
+
+
+def get_model_pool() -> ThreadPoolExecutor:
+    """Shared worker threads for blocking model calls, kept apart from the
+    default executor that serves the quick SQLite lookups."""
+    global _model_pool
+    if _model_pool is None:
+        _model_pool = ThreadPoolExecutor(max_workers=MODEL_WORKERS, thread_name_prefix="model")
+    return _model_pool
+
+
+async def run_model(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """Run `func(*args, **kwargs)` on the model pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_model_pool(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_model_pool() -> None:
+    global _model_pool
+    if _model_pool is not None:
+        _model_pool.shutdown(wait=False, cancel_futures=True)
+        _model_pool = None
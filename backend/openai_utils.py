@@ -13,14 +13,22 @@ class OpenAIClient:
         
         if not self.api_key:
             raise ValueError("OPENAI_API_KEY não encontrada nas variáveis de ambiente")
+
+        # One pooled HTTP/2 client for the process, so the TLS handshake is
+        # paid once instead of on every chat turn
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=30.0,
+            http2=True,
+            headers={
+                "Authorization": f"Bearer {self.api_key}",
+                "Content-Type": "application/json"
+            },
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=100),
+        )
     
     async def chat_completion(self, messages: List[Dict[str, str]]) -> str:
         """Send chat completion request to OpenAI."""
-        headers = {
-            "Authorization": f"Bearer {self.api_key}",
-            "Content-Type": "application/json"
-        }
-        
         data = {
             "model": self.model,
             "messages": messages,
@@ -29,17 +37,12 @@ class OpenAIClient:
         }
         
         try:
-            async with httpx.AsyncClient(timeout=30.0) as client:
-                response = await client.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=data
-                )
-                response.raise_for_status()
-                
-                result = response.json()
-                return result["choices"][0]["message"]["content"]
-                
+            response = await self._client.post("/chat/completions", json=data)
+            response.raise_for_status()
+            
+            result = response.json()
+            return result["choices"][0]["message"]["content"]
+            
         except httpx.HTTPStatusError as e:
             print(f"OpenAI API error: {e}")
             raise Exception(f"Error communicating with OpenAI: {str(e)}")
@@ -47,6 +50,9 @@ class OpenAIClient:
             print(f"Unexpected error: {e}")
             raise Exception(f"Unexpected error: {str(e)}")
 
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
 # Singleton instance
 _openai_client = None
 
@@ -56,6 +62,13 @@ def get_openai_client():
         _openai_client = OpenAIClient()
     return _openai_client
 
+async def close_openai_client() -> None:
+    """Close the pooled client if it was ever created."""
+    global _openai_client
+    if _openai_client is not None:
+        await _openai_client.aclose()
+        _openai_client = None
+
 async def openai_chat(messages: List[Dict[str, str]]) -> str:
     """Convenient function for OpenAI chat completion."""
     client = get_openai_client()
@@ -0,0 +1,332 @@
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import hnswlib
+import numpy as np
+
+from memory import open_db
+from vector_ops import EMBEDDING_DIM, decode_embeddings, encode_embedding, is_embedding_blob
+
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+EMBEDDING_BACKEND = os.environ.get("EMBEDDING_BACKEND", "onnx")  # "onnx" or "torch"
+EMBEDDING_MODEL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "embedding_models")
+ONNX_MODEL_PATH = os.path.join(EMBEDDING_MODEL_DIR, "model.int8.onnx")
+MAX_SEQ_LENGTH = 256
+SIMILARITY_THRESHOLD = 0.92
+MAX_ENTRIES = 100_000
+
+# HNSW index parameters
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+
+_SELECT_ENTRIES = "SELECT id, scope, reply, embedding FROM cache ORDER BY last_used DESC LIMIT ?"
+_TOUCH_ENTRY = "UPDATE cache SET last_used = ? WHERE id = ?"
+_INSERT_ENTRY = "INSERT INTO cache(scope, reply, embedding, last_used) VALUES (?, ?, ?, ?)"
+_DELETE_ENTRY = "DELETE FROM cache WHERE id = ?"
+
+
+class Embedder:
+    """Sentence embeddings with a small local MiniLM model (CPU)."""
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, device: str = "cpu") -> None:
+        self.model_name = model_name
+        self.device = device
+        self.model = None
+        self._load_model()
+
+    def _load_model(self) -> None:
+        if self.model is None:
+            from sentence_transformers import SentenceTransformer
+
+            print(f"Loading embedding model ({self.model_name})...")
+            self.model = SentenceTransformer(self.model_name, device=self.device)
+            print("Embedding model loaded!")
+
+    def embed(self, text: str) -> np.ndarray:
+        """Return the L2-normalized float32 embedding of `text`."""
+        vec = self.model.encode(text, normalize_embeddings=True, convert_to_numpy=True)
+        return np.ascontiguousarray(vec, dtype=np.float32)
+
+
+def export_onnx_model(model_name: str = EMBEDDING_MODEL, out_dir: str = EMBEDDING_MODEL_DIR) -> str:
+    """Export the embedding model to ONNX and quantize its weights to int8.
+
+    Writes `model.onnx`, `model.int8.onnx` and the tokenizer files to
+    `out_dir` and returns the path of the quantized model. Downloads the
+    model from Hugging Face, so it is run as a setup step
+    (`python semantic_cache.py`), never from the server.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(out_dir, exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(out_dir)
+
+    sample = tokenizer("Olá, tudo bem?", return_tensors="pt")
+    input_names = ["input_ids", "attention_mask", "token_type_ids"]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names + ["last_hidden_state"]}
+
+    fp32_path = os.path.join(out_dir, "model.onnx")
+    int8_path = os.path.join(out_dir, "model.int8.onnx")
+    with torch.no_grad():
+        torch.onnx.export(
+            model,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["last_hidden_state"],
+            dynamic_axes=dynamic_axes,
+            opset_version=14,
+        )
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
+
+
+class OnnxEmbedder:
+    """Same embeddings as `Embedder`, served by ONNX Runtime with int8 weights.
+
+    The ONNX file comes from `export_onnx_model()`; loading fails with
+    FileNotFoundError if it hasn't been exported. Tokenization of repeated
+    prompts is cached.
+    """
+
+    def __init__(self, model_path: str = ONNX_MODEL_PATH) -> None:
+        self.model_path = model_path
+        self.session = None
+        self.tokenizer = None
+        self._tokenize = lru_cache(maxsize=1024)(self._tokenize_uncached)
+        self._load_model()
+
+    def _load_model(self) -> None:
+        if self.session is None:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(
+                    f"ONNX embedding model not found at {self.model_path}; "
+                    "export it with `python semantic_cache.py`"
+                )
+
+            print(f"Loading embedding model ({self.model_path})...")
+            self.session = ort.InferenceSession(self.model_path, providers=["CPUExecutionProvider"])
+            self._input_names = {i.name for i in self.session.get_inputs()}
+            self.tokenizer = Tokenizer.from_file(os.path.join(os.path.dirname(self.model_path), "tokenizer.json"))
+            self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+            self.tokenizer.no_padding()
+            print("Embedding model loaded!")
+
+    def _tokenize_uncached(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        enc = self.tokenizer.encode(text)
+        ids = np.array([enc.ids], dtype=np.int64)
+        type_ids = np.array([enc.type_ids], dtype=np.int64)
+        ids.setflags(write=False)
+        type_ids.setflags(write=False)
+        return ids, type_ids
+
+    def embed(self, text: str) -> np.ndarray:
+        """Return the L2-normalized float32 embedding of `text`."""
+        ids, type_ids = self._tokenize(text)
+        feeds = {
+            "input_ids": ids,
+            "attention_mask": np.ones_like(ids),
+            "token_type_ids": type_ids,
+        }
+        hidden = self.session.run(None, {k: v for k, v in feeds.items() if k in self._input_names})[0]
+
+        # Mean pooling over tokens (no padding, so every token counts)
+        vec = hidden[0].mean(axis=0)
+        vec /= max(float(np.linalg.norm(vec)), 1e-12)
+        return np.ascontiguousarray(vec, dtype=np.float32)
+
+
+def cache_scope(user_id: str, messages: List[Dict[str, str]]) -> int:
+    """Hash the user id and every non-user message into a 64-bit scope key.
+
+    Replies are only reused between requests that share the exact same user
+    and system context; similarity is computed on the user text alone.
+    """
+    h = hashlib.blake2b(digest_size=8)
+    h.update(user_id.encode("utf-8"))
+    for msg in messages:
+        if msg["role"] != "user":
+            h.update(b"\x00")
+            h.update(msg["content"].encode("utf-8"))
+    return int.from_bytes(h.digest(), "little", signed=True)
+
+
+class SemanticCache:
+    """LLM reply cache looked up by cosine similarity of the user text.
+
+    Embeddings are indexed with HNSW (hnswlib), so a lookup costs O(log N)
+    instead of a scan over every entry. Entries are persisted to SQLite and
+    evicted in LRU order once `max_entries` is reached; the index itself is
+    saved with `save()` and reloaded on startup, or rebuilt from SQLite if it
+    is missing or stale.
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        dim: int = EMBEDDING_DIM,
+        threshold: float = SIMILARITY_THRESHOLD,
+        max_entries: int = MAX_ENTRIES,
+        index_path: Optional[str] = None,
+    ) -> None:
+        self.db_path = db_path
+        self.index_path = index_path or os.path.splitext(db_path)[0] + ".hnsw"
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+
+        self._scopes: Dict[int, int] = {}
+        self._replies: Dict[int, str] = {}
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._index = None
+
+        # Only used from the event loop thread, so no lock is needed
+        self.conn = open_db(db_path)
+        self._init_db()
+        self._load()
+
+    def _init_db(self) -> None:
+        self.conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS cache (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                scope INTEGER NOT NULL,
+                reply TEXT NOT NULL,
+                embedding BLOB NOT NULL,
+                last_used REAL NOT NULL
+            );
+            """
+        )
+
+    def _new_index(self) -> "hnswlib.Index":
+        index = hnswlib.Index(space="cosine", dim=self.dim)
+        index.init_index(
+            max_elements=self.max_entries,
+            ef_construction=HNSW_EF_CONSTRUCTION,
+            M=HNSW_M,
+            allow_replace_deleted=True,
+        )
+        index.set_ef(HNSW_EF_SEARCH)
+        return index
+
+    def _load(self) -> None:
+        rows = self.conn.execute(_SELECT_ENTRIES, (self.max_entries,)).fetchall()
+
+        # Oldest first so the LRU order matches the stored timestamps
+        rows = [r for r in reversed(rows) if is_embedding_blob(r[3], self.dim)]
+        for entry_id, scope, reply, _blob in rows:
+            self._scopes[entry_id] = scope
+            self._replies[entry_id] = reply
+            self._lru[entry_id] = None
+
+        if os.path.exists(self.index_path):
+            try:
+                index = hnswlib.Index(space="cosine", dim=self.dim)
+                index.load_index(self.index_path, max_elements=self.max_entries, allow_replace_deleted=True)
+                index.set_ef(HNSW_EF_SEARCH)
+                stored = set(index.get_ids_list())
+                if set(self._lru).issubset(stored):
+                    # Drop entries that were removed from SQLite after the last save
+                    for label in stored.difference(self._lru):
+                        try:
+                            index.mark_deleted(label)
+                        except RuntimeError:
+                            pass  # Already marked deleted
+                    self._index = index
+                    return
+            except RuntimeError as e:
+                print(f"Semantic cache index unreadable, rebuilding: {e}")
+
+        self._index = self._new_index()
+        if rows:
+            vecs = decode_embeddings([r[3] for r in rows], self.dim)
+            self._index.add_items(vecs, np.array([r[0] for r in rows], dtype=np.int64))
+
+    def save(self) -> None:
+        """Write the HNSW index next to the SQLite file."""
+        self._index.save_index(self.index_path)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def _evict_oldest(self) -> None:
+        entry_id, _ = self._lru.popitem(last=False)
+        del self._scopes[entry_id]
+        del self._replies[entry_id]
+        self._index.mark_deleted(entry_id)
+        self.conn.execute(_DELETE_ENTRY, (entry_id,))
+
+    def lookup(self, scope: int, query_emb: np.ndarray) -> Optional[str]:
+        """Return a cached reply whose query is similar enough, or None."""
+        if not self._lru:
+            return None
+
+        try:
+            labels, dists = self._index.knn_query(
+                query_emb, k=1, filter=lambda label: self._scopes.get(label) == scope
+            )
+        except RuntimeError:
+            # No entry in this scope
+            return None
+
+        if 1.0 - float(dists[0][0]) < self.threshold:
+            return None
+
+        entry_id = int(labels[0][0])
+        self._lru.move_to_end(entry_id)
+        self.conn.execute(_TOUCH_ENTRY, (time.time(), entry_id))
+        return self._replies[entry_id]
+
+    def add(self, scope: int, query_emb: np.ndarray, reply: str) -> None:
+        """Store `reply` for the given scope and (normalized) query embedding."""
+        if not reply.strip():
+            return
+
+        blob = encode_embedding(query_emb)
+        vec = np.ascontiguousarray(query_emb, dtype=np.float32)  # hnswlib normalizes for cosine
+        if len(self._lru) >= self.max_entries:
+            self._evict_oldest()
+        entry_id = self.conn.execute(_INSERT_ENTRY, (scope, reply, blob, time.time())).lastrowid
+
+        self._index.add_items(vec[np.newaxis, :], np.array([entry_id], dtype=np.int64), replace_deleted=True)
+        self._scopes[entry_id] = scope
+        self._replies[entry_id] = reply
+        self._lru[entry_id] = None
+
+
+# Singleton instance
+_embedder = None
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        if EMBEDDING_BACKEND == "onnx":
+            try:
+                _embedder = OnnxEmbedder()
+            except FileNotFoundError as e:
+                print(f"Aviso: {e}; usando sentence-transformers")
+                _embedder = Embedder()
+        else:
+            _embedder = Embedder()
+    return _embedder
+
+
+if __name__ == "__main__":
+    # Setup step: export the int8 ONNX embedder used by EMBEDDING_BACKEND=onnx
+    print(f"Embedding model exported to {export_onnx_model()}")
@@ -1,5 +1,6 @@
-from fastapi import FastAPI, WebSocket
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import Response
+import hashlib
 
 app = FastAPI()
 
@@ -73,9 +74,16 @@ html = """
 </html>
 """
 
+# Encoded once; browsers revalidate with the ETag and get a bodyless 304
+_HTML_BYTES = html.encode("utf-8")
+_ETAG = '"' + hashlib.blake2b(_HTML_BYTES, digest_size=8).hexdigest() + '"'
+_HTML_HEADERS = {"ETag": _ETAG, "Cache-Control": "public, max-age=3600"}
+
 @app.get("/")
-async def get():
-    return HTMLResponse(html)
+async def get(request: Request):
+    if request.headers.get("if-none-match") == _ETAG:
+        return Response(status_code=304, headers=_HTML_HEADERS)
+    return Response(content=_HTML_BYTES, media_type="text/html", headers=_HTML_HEADERS)
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
@@ -1,17 +1,22 @@
 import os
+import threading
 from dataclasses import dataclass
-from typing import Optional, Tuple
+from typing import Optional, Protocol, Tuple
 
 import numpy as np
 import torch
 import torchaudio
-from faster_whisper import WhisperModel
 
 MODEL_SIZE = "small"  # Good balance between speed and accuracy
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 COMPUTE_TYPE = "float16" if DEVICE == "cuda" else "int8"
 MODEL_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "whisper_models")
 
+# "faster-whisper" (CTranslate2) or "whisper.cpp" (ggml, needs pywhispercpp)
+STT_BACKEND = os.environ.get("STT_BACKEND", "faster-whisper")
+BEAM_SIZE = 5  # Good balance between speed and accuracy
+BATCH_SIZE = 8  # Chunks decoded together by the batched GPU pipeline
+
 
 @dataclass
 class STTResult:
@@ -21,23 +26,147 @@ class STTResult:
     segments: list
 
 
-class SpeechToText:
+class TranscriberBackend(Protocol):
+    """A Whisper implementation taking mono float32 audio at 16kHz."""
+
+    def transcribe(
+        self,
+        audio: np.ndarray,
+        language: Optional[str] = None,
+        initial_prompt: Optional[str] = None,
+        word_timestamps: bool = False,
+    ) -> STTResult:
+        ...
+
+
+class FasterWhisperBackend:
+    """faster-whisper (CTranslate2); on CUDA, chunks are decoded in batches."""
+
     def __init__(self, model_size: str = MODEL_SIZE, device: str = DEVICE):
+        from faster_whisper import WhisperModel
+
+        print(f"Loading Whisper model ({model_size})...")
+        self.model = WhisperModel(
+            model_size,
+            device=device,
+            compute_type=COMPUTE_TYPE,
+            download_root=MODEL_CACHE_DIR,
+        )
+        self.pipeline = None
+        if device == "cuda":
+            try:
+                from faster_whisper import BatchedInferencePipeline
+            except ImportError:
+                pass  # Older faster-whisper, decode sequentially
+            else:
+                self.pipeline = BatchedInferencePipeline(model=self.model)
+        print("Whisper model loaded!")
+
+    def transcribe(
+        self,
+        audio: np.ndarray,
+        language: Optional[str] = None,
+        initial_prompt: Optional[str] = None,
+        word_timestamps: bool = False,
+    ) -> STTResult:
+        options = dict(
+            language=language,
+            initial_prompt=initial_prompt,
+            beam_size=BEAM_SIZE,
+            condition_on_previous_text=False,  # Disable for better performance
+            word_timestamps=word_timestamps,
+        )
+        if self.pipeline is not None:
+            segments, info = self.pipeline.transcribe(audio, batch_size=BATCH_SIZE, **options)
+        else:
+            segments, info = self.model.transcribe(audio, **options)
+
+        # Convert segments to list and get full text
+        segments_list = []
+        full_text = []
+        for segment in segments:
+            segments_list.append({
+                "start": segment.start,
+                "end": segment.end,
+                "text": segment.text,
+                "words": [{"word": w.word, "start": w.start, "end": w.end, "score": w.probability} 
+                         for w in (segment.words or [])]
+            })
+            full_text.append(segment.text)
+
+        return STTResult(
+            text="".join(full_text).strip(),
+            language=info.language,
+            confidence=info.language_probability,
+            segments=segments_list,
+        )
+
+
+class WhisperCppBackend:
+    """whisper.cpp through pywhispercpp: int8/ggml SIMD kernels, CPU only."""
+
+    def __init__(self, model_size: str = MODEL_SIZE):
+        from pywhispercpp.model import Model
+
+        print(f"Loading whisper.cpp model ({model_size})...")
+        self.model = Model(
+            model_size,
+            models_dir=MODEL_CACHE_DIR,
+            n_threads=os.cpu_count() or 4,
+            print_progress=False,
+            print_realtime=False,
+        )
+        print("whisper.cpp model loaded!")
+
+    def transcribe(
+        self,
+        audio: np.ndarray,
+        language: Optional[str] = None,
+        initial_prompt: Optional[str] = None,
+        word_timestamps: bool = False,
+    ) -> STTResult:
+        params = {"language": language or "auto"}
+        if initial_prompt:
+            params["initial_prompt"] = initial_prompt
+        segments = self.model.transcribe(audio, **params)
+
+        # whisper.cpp timestamps are in 10 ms units
+        segments_list = [
+            {"start": seg.t0 / 100.0, "end": seg.t1 / 100.0, "text": seg.text, "words": []}
+            for seg in segments
+        ]
+        return STTResult(
+            text="".join(seg["text"] for seg in segments_list).strip(),
+            language=language or "auto",
+            confidence=1.0,  # whisper.cpp does not report language probability
+            segments=segments_list,
+        )
+
+
+def load_backend(name: str = STT_BACKEND, model_size: str = MODEL_SIZE, device: str = DEVICE) -> TranscriberBackend:
+    if name == "whisper.cpp":
+        return WhisperCppBackend(model_size)
+    if name == "faster-whisper":
+        return FasterWhisperBackend(model_size, device)
+    raise ValueError(f"Unknown STT_BACKEND: {name}")
+
+
+class SpeechToText:
+    def __init__(self, model_size: str = MODEL_SIZE, device: str = DEVICE, backend: str = STT_BACKEND):
         self.model_size = model_size
         self.device = device
-        self.model = None
+        self.backend_name = backend
+        self.model: Optional[TranscriberBackend] = None
+        # Resample builds its FIR kernel on construction, so keep one per input rate
+        self._resamplers: dict[int, torchaudio.transforms.Resample] = {}
+        # Connections transcribe from the multi-threaded model pool, and a
+        # whisper.cpp context can't run two decodes at once
+        self._lock = threading.Lock()
         self._load_model()
 
     def _load_model(self):
         if self.model is None:
-            print(f"Loading Whisper model ({self.model_size})...")
-            self.model = WhisperModel(
-                self.model_size,
-                device=self.device,
-                compute_type=COMPUTE_TYPE,
-                download_root=MODEL_CACHE_DIR,
-            )
-            print("Whisper model loaded!")
+            self.model = load_backend(self.backend_name, self.model_size, self.device)
 
     def transcribe(
         self,
@@ -45,6 +174,7 @@ class SpeechToText:
         sample_rate: int = 16000,
         language: Optional[str] = "pt",
         initial_prompt: Optional[str] = None,
+        word_timestamps: bool = False,
     ) -> STTResult:
         """Transcribe audio data to text using Whisper.
         
@@ -53,6 +183,7 @@ class SpeechToText:
             sample_rate: Sample rate of the audio data
             language: Language code (e.g., 'pt' for Portuguese)
             initial_prompt: Optional prompt to guide the model
+            word_timestamps: Also return per-word timings in the segments
             
         Returns:
             STTResult containing the transcription and metadata
@@ -72,34 +203,10 @@ class SpeechToText:
         if audio_data.dtype != np.float32:
             audio_data = audio_data.astype(np.float32) / 32768.0
 
-        # Transcribe
-        segments, info = self.model.transcribe(
-            audio_data,
-            language=language,
-            initial_prompt=initial_prompt,
-            beam_size=5,  # Good balance between speed and accuracy
-            condition_on_previous_text=False,  # Disable for better performance
-        )
-
-        # Convert segments to list and get full text
-        segments_list = []
-        full_text = []
-        for segment in segments:
-            segments_list.append({
-                "start": segment.start,
-                "end": segment.end,
-                "text": segment.text,
-                "words": [{"word": w.word, "start": w.start, "end": w.end, "score": w.probability} 
-                         for w in (segment.words or [])]
-            })
-            full_text.append(segment.text)
-
-        return STTResult(
-            text="".join(full_text).strip(),
-            language=info.language,
-            confidence=info.language_probability,
-            segments=segments_list,
-        )
+        with self._lock:
+            return self.model.transcribe(
+                audio_data, language=language, initial_prompt=initial_prompt, word_timestamps=word_timestamps
+            )
 
     def _resample_audio(self, audio_data: np.ndarray, original_rate: int) -> np.ndarray:
         """Resample audio to 16kHz if needed."""
@@ -111,18 +218,26 @@ class SpeechToText:
         if len(audio_tensor.shape) == 1:
             audio_tensor = audio_tensor.unsqueeze(0)  # Add channel dimension
             
-        # Resample
-        resampler = torchaudio.transforms.Resample(
-            orig_freq=original_rate,
-            new_freq=16000,
-            resampling_method="kaiser_window",
-            lowpass_filter_width=6,
-            rolloff=0.99,
-            dtype=audio_tensor.dtype,
-        )
-        
-        resampled = resampler(audio_tensor)
-        return resampled.squeeze().numpy()
+        return self._resample_tensor(audio_tensor, original_rate).squeeze().numpy()
+
+    def _resample_tensor(self, audio_tensor: torch.Tensor, original_rate: int) -> torch.Tensor:
+        """Resample a float32 (channels, samples) tensor to 16kHz."""
+        if original_rate == 16000:
+            return audio_tensor
+
+        resampler = self._resamplers.get(original_rate)
+        if resampler is None:
+            resampler = torchaudio.transforms.Resample(
+                orig_freq=original_rate,
+                new_freq=16000,
+                resampling_method="kaiser_window",
+                lowpass_filter_width=6,
+                rolloff=0.99,
+                dtype=torch.float32,
+            )
+            self._resamplers[original_rate] = resampler
+
+        return resampler(audio_tensor)
 
 
 # Global instance
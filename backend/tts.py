@@ -1,12 +1,17 @@
+import hashlib
 import os
+import re
+import threading
 import time
+from collections import OrderedDict
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Optional, Tuple
+from typing import AsyncGenerator, Iterator, List, Optional, Tuple
 
 import numpy as np
 import soundfile as sf
-import pyttsx3
+
+from model_pool import run_model
 
 VOICES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "voices")
 CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "tts_cache")
@@ -17,6 +22,17 @@ os.makedirs(CACHE_DIR, exist_ok=True)
 # Configuração da voz feminina fofa (ajustável)
 DEFAULT_VOICE = "female_fofinha"
 
+# "piper" (neural, ONNX Runtime, streams while synthesizing) or "pyttsx3"
+TTS_BACKEND = os.environ.get("TTS_BACKEND", "piper")
+PIPER_VOICE = os.environ.get("PIPER_VOICE", os.path.join(VOICES_DIR, "pt_BR-faber-medium.onnx"))
+
+# Synthesized phrases kept decoded in memory (greetings, fallbacks, ...)
+MEM_CACHE_SIZE = 256
+
+# A run of sentence-ending punctuation ("...", "?!" stay together) that is
+# not inside a number like "3.5"
+_SENTENCE_END_RE = re.compile(r"[.!?]+(?=\s|$)")
+
 # Configurações para pyttsx3
 VOICE_SETTINGS = {
     "rate": 200,  # Words per minute
@@ -27,16 +43,58 @@ VOICE_SETTINGS = {
 
 @dataclass
 class TTSResult:
-    audio: np.ndarray
+    audio: np.ndarray  # int16 mono PCM, full scale 32767; the wire format as is
     sample_rate: int
     phonemes: Optional[list] = None
 
 
+def _silence() -> TTSResult:
+    return TTSResult(np.zeros(22050, dtype=np.int16), 22050)
+
+
 class TTSEngine:
-    def __init__(self):
-        self.engine = pyttsx3.init()
-        self._configure_voice()
+    def __init__(self, backend: str = TTS_BACKEND):
+        self.backend = backend
+        self._mem_cache: "OrderedDict[str, TTSResult]" = OrderedDict()
+        # Synthesis runs on the multi-threaded model pool: the LRU is shared,
+        # and a pyttsx3 engine must not run two runAndWait() loops at once
+        self._cache_lock = threading.Lock()
+        self._engine_lock = threading.Lock()
+        self.engine = None
+        self.voice = None
+        self.sample_rate = 22050
+
+        if backend == "piper":
+            self.voice = self._load_piper()
+            if self.voice is None:
+                # Cached clips are keyed by backend, so don't reuse Piper's
+                self.backend = "pyttsx3"
+            else:
+                self.sample_rate = self.voice.config.sample_rate
+
+        if self.voice is None:
+            import pyttsx3
+
+            self.engine = pyttsx3.init()
+            self._configure_voice()
         
+    @staticmethod
+    def _load_piper():
+        """Load the Piper voice, or return None so pyttsx3 is used instead."""
+        try:
+            from piper.voice import PiperVoice
+        except ImportError:
+            print("Aviso: piper-tts não está instalado, usando pyttsx3")
+            return None
+        if not os.path.exists(PIPER_VOICE):
+            print(f"Aviso: voz do Piper não encontrada ({PIPER_VOICE}), usando pyttsx3")
+            return None
+
+        print(f"Loading Piper voice ({PIPER_VOICE})...")
+        voice = PiperVoice.load(PIPER_VOICE)
+        print("Piper voice loaded!")
+        return voice
+
     def _configure_voice(self):
         """Configure the TTS engine with female voice settings."""
         # Get available voices
@@ -60,34 +118,136 @@ class TTSEngine:
         self.engine.setProperty('rate', VOICE_SETTINGS["rate"])
         self.engine.setProperty('volume', VOICE_SETTINGS["volume"])
 
+    def _cache_path(self, text: str) -> str:
+        # Stable across restarts, unlike hash() which is salted per process
+        key = hashlib.blake2b(f"{self.backend}\x00{text}".encode("utf-8"), digest_size=12).hexdigest()
+        return os.path.join(CACHE_DIR, f"tts_{key}.wav")
+
+    @staticmethod
+    def _partial_path(path: str) -> str:
+        """Per-thread file to render into before it is moved over `path`, so
+        other threads never read a half-written clip."""
+        return f"{path[:-4]}.{threading.get_ident()}.tmp.wav"
+
+    def _cached(self, text: str) -> Optional[TTSResult]:
+        """Look `text` up in the in-memory LRU, then in the WAV file cache."""
+        with self._cache_lock:
+            cached = self._mem_cache.get(text)
+            if cached is not None:
+                self._mem_cache.move_to_end(text)
+                return cached
+
+        output_path = self._cache_path(text)
+        if os.path.exists(output_path):
+            audio, sample_rate = sf.read(output_path, dtype="int16")
+            return self._remember(text, TTSResult(audio, sample_rate))
+        return None
+
+    def _store_pcm(self, text: str, pcm: bytes) -> TTSResult:
+        """Cache a fully rendered 16-bit Piper clip on disk and in memory."""
+        audio = np.frombuffer(pcm, dtype=np.int16)
+        output_path = self._cache_path(text)
+        partial_path = self._partial_path(output_path)
+        sf.write(partial_path, audio, self.sample_rate, subtype="PCM_16")
+        os.replace(partial_path, output_path)
+        return self._remember(text, TTSResult(audio, self.sample_rate))
+
     def synthesize(self, text: str, speed: Optional[float] = None) -> TTSResult:
-        """Synthesize text to speech using pyttsx3."""
+        """Synthesize the whole clip for `text`."""
         if not text.strip():
-            return TTSResult(np.zeros(22050), 22050)
+            return _silence()
 
-        output_path = os.path.join(CACHE_DIR, f"tts_{hash(text) % 1000000}.wav")
-        
-        # Check cache first
-        if os.path.exists(output_path):
-            audio, sample_rate = sf.read(output_path)
-            return TTSResult(audio, sample_rate)
+        cached = self._cached(text)
+        if cached is not None:
+            return cached
 
+        if self.voice is not None:
+            try:
+                return self._store_pcm(text, b"".join(self.voice.synthesize_stream_raw(text)))
+            except Exception as e:
+                print(f"Erro ao gerar áudio: {e}")
+                return _silence()
+
+        output_path = self._cache_path(text)
+        partial_path = self._partial_path(output_path)
         try:
             # Save to file
-            self.engine.save_to_file(text, output_path)
-            self.engine.runAndWait()
+            with self._engine_lock:
+                self.engine.save_to_file(text, partial_path)
+                self.engine.runAndWait()
             
             # Load the generated audio
-            audio, sample_rate = sf.read(output_path)
+            audio, sample_rate = sf.read(partial_path, dtype="int16")
+            os.replace(partial_path, output_path)
             
             # Convert to mono if needed
             if len(audio.shape) > 1:
-                audio = np.mean(audio, axis=1)
+                audio = np.mean(audio, axis=1).astype(np.int16)
             
-            return TTSResult(audio, sample_rate)
+            return self._remember(text, TTSResult(audio, sample_rate))
         except Exception as e:
             print(f"Erro ao gerar áudio: {e}")
-            return TTSResult(np.zeros(22050), 22050)
+            return _silence()
+
+    def stream(self, text: str) -> Iterator[Tuple[np.ndarray, int]]:
+        """Yield (int16 audio, sample_rate) chunks as soon as they are ready.
+
+        With Piper each sentence is yielded while the next one is being
+        synthesized, and the joined clip is cached at the end. Cached phrases
+        and the pyttsx3 backend yield the whole clip at once.
+        """
+        if not text.strip():
+            return
+
+        if self.voice is not None and self._cached(text) is None:
+            chunks = []
+            for pcm in self.voice.synthesize_stream_raw(text):
+                chunks.append(pcm)
+                yield np.frombuffer(pcm, dtype=np.int16), self.sample_rate
+            self._store_pcm(text, b"".join(chunks))
+            return
+
+        result = self.synthesize(text)
+        yield result.audio, result.sample_rate
+
+    async def synthesize_stream(self, text: str) -> AsyncGenerator[Tuple[np.ndarray, int], None]:
+        """Yield (int16 audio, sample_rate) chunks sentence by sentence.
+
+        Synthesis runs on the model pool, so the event loop keeps sending
+        earlier chunks meanwhile. Each sentence is cached on its own, which
+        lets recurring sentences be reused across different replies.
+        """
+        for sentence in split_sentences(text):
+            chunks = self.stream(sentence)
+            while True:
+                chunk = await run_model(next, chunks, None)
+                if chunk is None:
+                    break
+                yield chunk
+
+    def _remember(self, text: str, result: TTSResult) -> TTSResult:
+        """Keep `result` in the in-memory LRU; the buffer is shared, so it is made read-only."""
+        result.audio.setflags(write=False)
+        with self._cache_lock:
+            self._mem_cache[text] = result
+            if len(self._mem_cache) > MEM_CACHE_SIZE:
+                self._mem_cache.popitem(last=False)
+        return result
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split `text` after each run of sentence-ending punctuation."""
+    sentences = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        sentence = text[start:match.end()].strip()
+        if sentence:
+            sentences.append(sentence)
+        start = match.end()
+    tail = text[start:].strip()
+    if tail:
+        sentences.append(tail)
+    return sentences
 
 
 tts_engine = TTSEngine()
@@ -0,0 +1,106 @@
+from typing import Sequence, Tuple
+
+import numpy as np
+from numba import njit, prange
+
+# MiniLM sentence embedding size
+EMBEDDING_DIM = 384
+
+
+def _quantize_rows(mat: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 quantization with one float32 scale per row."""
+    peak = np.abs(mat).max(axis=1)
+    scales = np.where(peak > 0.0, peak / 127.0, 1.0).astype(np.float32)
+    q8 = np.clip(np.rint(mat / scales[:, np.newaxis]), -127, 127).astype(np.int8)
+    return q8, scales
+
+
+def encode_embedding(vec: np.ndarray) -> bytes:
+    """Normalize an embedding and pack it as int8 with a per-vector scale.
+
+    Vectors are stored pre-normalized so similarity is a plain dot product.
+    Layout: float32 scale followed by `dim` int8 values (dim + 4 bytes, a
+    quarter of float32).
+    """
+    v = np.asarray(vec, dtype=np.float32)
+    norm = float(np.linalg.norm(v))
+    if norm > 0.0:
+        v = v / norm
+    q8, scales = _quantize_rows(v[np.newaxis, :])
+    return scales.tobytes() + q8.tobytes()
+
+
+def is_embedding_blob(blob: bytes, dim: int = EMBEDDING_DIM) -> bool:
+    """True for a stored int8 row, or a legacy float16/float32 one."""
+    return blob is not None and len(blob) in (dim + 4, dim * 2, dim * 4)
+
+
+def load_quantized(blobs: Sequence[bytes], dim: int = EMBEDDING_DIM) -> Tuple[np.ndarray, np.ndarray]:
+    """Unpack stored rows into an (N, dim) int8 matrix and its (N,) scales.
+
+    The int8 matrix is a view over one joined buffer; legacy float rows are
+    quantized on the fly.
+    """
+    if all(len(b) == dim + 4 for b in blobs):
+        packed = np.frombuffer(b"".join(blobs), dtype=np.uint8).reshape(len(blobs), dim + 4)
+        scales = np.ascontiguousarray(packed[:, :4]).view(np.float32).ravel()
+        return packed[:, 4:].view(np.int8), scales
+    return _quantize_rows(decode_embeddings(blobs, dim))
+
+
+def decode_embeddings(blobs: Sequence[bytes], dim: int = EMBEDDING_DIM) -> np.ndarray:
+    """Unpack stored rows into one contiguous (N, dim) float32 matrix."""
+    out = np.empty((len(blobs), dim), dtype=np.float32)
+    for i, b in enumerate(blobs):
+        if len(b) == dim + 4:
+            scale = np.frombuffer(b, dtype=np.float32, count=1)[0]
+            out[i] = np.frombuffer(b, dtype=np.int8, offset=4) * scale
+        else:
+            out[i] = np.frombuffer(b, dtype=np.float16 if len(b) == dim * 2 else np.float32)
+    return out
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def cosine_scores(mat: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """Dot every row of `mat` (N x d, normalized) with the normalized query `q`.
+
+    Fused multiply-add loop compiled with Numba: no temporary N x d product is
+    materialized and rows are split across threads.
+    """
+    n = mat.shape[0]
+    d = mat.shape[1]
+    out = np.empty(n, np.float32)
+    for i in prange(n):
+        s = np.float32(0.0)
+        for j in range(d):
+            s += mat[i, j] * q[j]
+        out[i] = s
+    return out
+
+
+@njit(parallel=True, fastmath=True, cache=True)
+def cosine_scores_int8(mat: np.ndarray, scales: np.ndarray, q: np.ndarray) -> np.ndarray:
+    """`cosine_scores` over an int8-quantized matrix with per-row scales.
+
+    Reads a quarter of the bytes of the float32 kernel; the scale is applied
+    once per row after the dot product.
+    """
+    n = mat.shape[0]
+    d = mat.shape[1]
+    out = np.empty(n, np.float32)
+    for i in prange(n):
+        s = np.float32(0.0)
+        for j in range(d):
+            s += np.float32(mat[i, j]) * q[j]
+        out[i] = s * scales[i]
+    return out
+
+
+def warmup(dim: int = EMBEDDING_DIM) -> None:
+    """Compile the kernels ahead of the first request."""
+    q = np.zeros(dim, dtype=np.float32)
+    mat = np.zeros((1, dim), dtype=np.float32)
+    cosine_scores(mat, q)
+
+    mat8, scales = load_quantized([encode_embedding(q)], dim)
+    cosine_scores_int8(mat8, scales, q)
@@ -1,21 +1,25 @@
 import asyncio
-import json
 import logging
-import time
-from dataclasses import dataclass
-from typing import Dict, Optional, Any, AsyncGenerator
+import math
+import random
+import re
+import struct
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Any, AsyncGenerator, Set, Tuple
 
 import numpy as np
-import sounddevice as sd
+import orjson
 import soundfile as sf
 from fastapi import WebSocket, WebSocketDisconnect
-from faster_whisper import WhisperModel
 
+from audio_codec import OpusStream, opus_available
+from audio_ops import frame_energy, ring_write
 from stt import SpeechToText, STTResult
 from tts import TTSEngine, TTSResult
-from llm_utils import ollama_chat, build_messages, maybe_extract_fact
+from llm_utils import ollama_chat_stream, build_prefix, maybe_extract_fact
 from openai_utils import openai_chat
 from memory import MemoryStore
+from model_pool import run_model
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,71 +27,153 @@ logger = logging.getLogger(__name__)
 
 # Audio configuration
 SAMPLE_RATE = 16000
-CHANNELS = 1
-CHUNK_SIZE = 1024
-SILENCE_THRESHOLD = 0.01  # Adjust based on your microphone sensitivity
+VAD_DBFS = -40.0  # Speech threshold on frame energy (RMS 0.01); adjust to the microphone
+VAD_START_FRAMES = 3  # Consecutive voiced frames before recording starts, so clicks don't start one
+VAD_PREROLL = 0.2  # seconds kept before the first voiced frame, so soft onsets aren't clipped
 SILENCE_DURATION = 1.5  # seconds of silence to consider end of speech
 
+# Scheduled ASR while the user is speaking: every ASR_INTERVAL the uncommitted
+# audio (at most ASR_WINDOW) is decoded, and words that ended more than
+# ASR_STABILITY before the end of the window are committed. At end of speech
+# only the uncommitted tail is left to decode.
+ASR_INTERVAL = 1.0  # seconds
+ASR_WINDOW = 15.0  # seconds
+ASR_STABILITY = 1.0  # seconds
+ASR_MIN_AUDIO = 0.5  # seconds; shorter spans are not worth a decode
+ASR_PROMPT = "Transcrição de voz para uma assistente virtual."
+SILENT_PEAK = 1e-3  # Spans quieter than this are not sent to Whisper
+
+# Binary frames start with a 1-byte type tag so the client can demux them;
+# audio frames follow it with the sample rate (uint32 LE), then either raw
+# samples or one 20 ms Opus packet
+FRAME_AUDIO_PCM16 = 0x01
+FRAME_AUDIO_OPUS = 0x02
+_AUDIO_HEADER = struct.Struct("<BI")
+AUDIO_QUEUE_SIZE = 8  # Synthesized chunks held ahead of the sender
+
+# A sentence in the streamed LLM reply is complete once its closing
+# punctuation run is followed by whitespace
+_SENTENCE_BREAK_RE = re.compile(r"[.!?]+(?=\s)")
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    # orjson encodes straight to UTF-8; frames stay text because the
+    # client reserves binary frames for tagged audio
+    return orjson.dumps(data, option=orjson.OPT_SERIALIZE_NUMPY).decode("utf-8")
+
+
+# Constant replies, serialized once
+_FRAME_PONG = _dumps({"type": "pong"})
+_FRAME_LISTENING = _dumps({"type": "status", "status": "listening"})
+_FRAME_IDLE = _dumps({"type": "status", "status": "idle"})
+
+# Fallback replies when the LLM is unreachable, picked by the first matching
+# pattern (greeting, then question, then compliment)
+_GREETING_RE = re.compile(r"\b(?:oi|ola|olá|eai|e aí)\b")
+_QUESTION_RE = re.compile(r"\?|\b(?:qual|como|onde|quando|por que)\b")
+_COMPLIMENT_RE = re.compile(r"\b(?:linda|bonita|legal|gostosa|maravilhosa)")  # also "lindas", "legalzinha"
+
+FALLBACK_GREETINGS = (
+    "Oieee! Tudo bem? 😊",
+    "Olá! Que bom conversar com você! 🌸",
+    "E aí! Sumida! 😄",
+    "Oiiee! Como vai? ✨",
+)
+FALLBACK_QUESTION_RESPONSES = (
+    "Hmm, boa pergunta! Mas sem o Ollama eu não consigo pensar muito fundo... 🤔",
+    "Nossa, você me pegou! Preciso do meu cérebro AI para responder direito! 🧠",
+    "Essa é difícil! Meu superpoder AI está em manutenção! 😅",
+    "Bom... sem meus superpoderes de IA, fico um pouco limitada! 🤖",
+)
+FALLBACK_COMPLIMENT_RESPONSES = (
+    "Awwwn, você é muito gentil! 😊💕",
+    "Nossa, obrigada! Fiquei toda corada! 🌸",
+    "Para de! Você me deixa sem jeito! 😄",
+    "Mashiaaa! Você é o melhor! ✨",
+)
+FALLBACK_DEFAULT_RESPONSES = (
+    "Legal! Mas sem o Ollama eu não consigo responder muito bem... 😅",
+    "Hmm, interessante! Preciso do meu cérebro AI para conversar direitinho! 🤖",
+    "Nossa, você sabe que sem meu superpoder de IA fico meio limitada? 🤔",
+    "Legal demais! Mas para responder melhor, preciso do Ollama rodando! 🌸",
+)
+
 
 @dataclass
 class AudioBuffer:
-    """Circular buffer for audio data."""
-    data: np.ndarray
+    """Circular buffer for audio data.
+
+    The capacity is rounded up to a power of two so positions wrap with a
+    mask instead of a modulo. `write` only ever grows; `count` is the number
+    of valid samples, ending at `write`.
+    """
     sample_rate: int
     max_duration: float = 30.0  # Maximum duration in seconds
+    data: np.ndarray = field(init=False, repr=False)
     
     def __post_init__(self):
         max_samples = int(self.sample_rate * self.max_duration)
-        self.data = np.zeros(max_samples, dtype=np.float32)
-        self.start_idx = 0
-        self.end_idx = 0
+        size = 1 << (max_samples - 1).bit_length()
+        self.data = np.zeros(size, dtype=np.float32)
+        # Destination for spans that wrap around the end of the ring
+        self._scratch = np.empty(size, dtype=np.float32)
+        self.mask = size - 1
+        self.write = 0
+        self.count = 0
         self.is_recording = False
         
     def append(self, audio_chunk: np.ndarray):
-        """Append audio data to the buffer."""
-        chunk_size = len(audio_chunk)
-        if chunk_size == 0:
+        """Append audio data to the buffer, overwriting the oldest samples when full."""
+        n = len(audio_chunk)
+        if n == 0:
             return
-            
-        # Calculate available space
-        available = len(self.data) - (self.end_idx - self.start_idx) % len(self.data)
-        if available < chunk_size:
-            # Buffer is full, discard old data
-            self.start_idx = (self.start_idx + (chunk_size - available)) % len(self.data)
-            
-        # Add new data
-        end = (self.end_idx + chunk_size) % len(self.data)
-        if end > self.end_idx:
-            self.data[self.end_idx:end] = audio_chunk
-        else:
-            # Handle wrap-around
-            remaining = len(self.data) - self.end_idx
-            self.data[self.end_idx:] = audio_chunk[:remaining]
-            self.data[:end] = audio_chunk[remaining:]
-            
-        self.end_idx = end
+        # Compiled copy loop; wrap-around is handled by the mask
+        self.write = ring_write(self.data, self.write, self.mask, audio_chunk)
+        self.count = min(self.count + n, self.data.shape[0])
         
     def get_audio(self, start_time: float, end_time: float) -> np.ndarray:
-        """Get audio data between start_time and end_time in seconds."""
-        start_sample = int(start_time * self.sample_rate)
-        end_sample = int(end_time * self.sample_rate)
-        start_idx = (self.start_idx + start_sample) % len(self.data)
-        end_idx = (self.start_idx + end_sample) % len(self.data)
-        
-        if end_idx > start_idx:
-            return self.data[start_idx:end_idx]
+        """Get audio data between start_time and end_time in seconds, from the oldest held sample."""
+        oldest = self.write - self.count
+        return self.get_span(
+            oldest + int(start_time * self.sample_rate),
+            oldest + int(end_time * self.sample_rate),
+        )
+    
+    def get_span(self, start: int, end: int) -> np.ndarray:
+        """Get the samples at absolute stream positions [start, end), clamped to what is held.
+
+        The result is a view, into the ring or into a scratch buffer when the
+        span wraps; it is only valid until the next append or get call.
+        """
+        start = max(start, self.write - self.count)
+        end = min(end, self.write)
+        n = end - start
+        if n <= 0:
+            return self.data[:0]
+            
+        start_idx = start & self.mask
+        if start_idx + n <= self.data.shape[0]:
+            return self.data[start_idx:start_idx + n]
         else:
-            return np.concatenate([self.data[start_idx:], self.data[:end_idx]])
+            first = self.data.shape[0] - start_idx
+            dst = self._scratch[:n]
+            np.copyto(dst[:first], self.data[start_idx:])
+            np.copyto(dst[first:], self.data[:n - first])
+            return dst
     
     def clear(self):
         """Clear the buffer."""
-        self.start_idx = 0
-        self.end_idx = 0
+        self.write = 0
+        self.count = 0
         self.is_recording = False
 
 
 class VTuberWebSocketHandler:
-    """Handles WebSocket connections for the VTuber application."""
+    """Handles one WebSocket connection for the VTuber application.
+
+    Every instance holds that connection's audio buffer, VAD/ASR worker tasks
+    and reply state, so a new one is created for each client.
+    """
     
     def __init__(self, stt_engine: SpeechToText, tts_engine: TTSEngine, memory: MemoryStore, 
                  ollama_host: str, ollama_model: str, system_prompt: str, llm_provider: str = "ollama"):
@@ -102,12 +188,37 @@ class VTuberWebSocketHandler:
         self.current_user_id = None
         self.is_listening = False
         self.audio_buffer = AudioBuffer(sample_rate=SAMPLE_RATE)
-        self.vad_threshold = SILENCE_THRESHOLD
-        self.last_audio_time = 0
-        self.silence_start_time = None
-        self.vad_threshold = 0.5  # Voice activity detection threshold
+        self._set_vad_dbfs(VAD_DBFS)
+        self._voiced_frames = 0  # Consecutive voiced frames
+        self._voiced_samples = 0  # ... and the samples they hold
+        self._endpoint_handle: Optional[asyncio.TimerHandle] = None  # Armed while silent during recording
+        # Cleared while an utterance is being answered; at most one runs at a
+        # time and a later one waits as the current recording
+        self._asr_busy = asyncio.Event()
+        self._asr_busy.set()
+        self._endpoint_pending = False  # The waiting utterance already ended
         self.current_user_id = "default"
         self.websocket: Optional[WebSocket] = None
+        # Microphone frames received from the client, consumed by the VAD worker
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._frame_queue: Optional[asyncio.Queue] = None
+        self._bad_audio_logged = False
+        self._vad_task: Optional[asyncio.Task] = None
+        # Scheduled ASR state: audio before _commit_ptr (absolute buffer
+        # position) is already transcribed into _committed_text
+        self._asr_task: Optional[asyncio.Task] = None
+        self._asr_lock = asyncio.Lock()
+        self._commit_ptr = 0
+        self._committed_text: List[str] = []
+        # Set when the client asked for Opus (audio_config codec) and opuslib is installed
+        self._opus: Optional[OpusStream] = None
+        self._fact_tasks: Set[asyncio.Task] = set()
+        # Replies run as tasks so the receive loop keeps reading audio frames;
+        # text turns take _text_lock so they are answered in order
+        self._turn_tasks: Set[asyncio.Task] = set()
+        self._text_lock = asyncio.Lock()
+        # Per-user system + memories prefix, with the memory generation it was built at
+        self._msg_prefix: Dict[str, Tuple[int, List[Dict[str, str]]]] = {}
         
     async def connect(self, websocket: WebSocket, user_id: str = "default"):
         """Handle a new WebSocket connection."""
@@ -116,16 +227,28 @@ class VTuberWebSocketHandler:
         await websocket.accept()
         
         try:
-            # Initialize audio stream
-            await self._start_audio_stream()
+            # The client streams its microphone over this socket; VAD runs in a worker task
+            self.loop = asyncio.get_running_loop()
+            self._frame_queue = asyncio.Queue()
+            self._voiced_frames = 0
+            self._voiced_samples = 0
+            self._opus = None  # Raw PCM until the client asks for Opus
+            self._bad_audio_logged = False
+            self._vad_task = asyncio.create_task(self._vad_worker())
+            self._asr_task = asyncio.create_task(self._asr_scheduler())
             
-            # Main message loop
+            # Main message loop: JSON in text frames, microphone audio in binary ones
             while True:
+                frame = await websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    raise WebSocketDisconnect(frame.get("code", 1000))
                 try:
-                    data = await websocket.receive_text()
-                    message = json.loads(data)
+                    if frame.get("bytes") is not None:
+                        self._handle_audio_frame(frame["bytes"])
+                        continue
+                    message = orjson.loads(frame["text"])
                     await self._handle_message(message)
-                except json.JSONDecodeError:
+                except orjson.JSONDecodeError:
                     logger.error("Invalid JSON received")
                     await self._send_error("Invalid JSON format")
                 except Exception as e:
@@ -139,79 +262,175 @@ class VTuberWebSocketHandler:
         finally:
             await self.cleanup()
     
-    async def _start_audio_stream(self):
-        """Start the audio input stream."""
-        if self.stream is not None:
-            self.stream.close()
+    def _handle_audio_frame(self, data: bytes):
+        """Queue one tagged PCM16 microphone frame from the client for the VAD worker."""
+        payload = len(data) - _AUDIO_HEADER.size
+        tag, sample_rate = _AUDIO_HEADER.unpack_from(data) if payload >= 0 else (None, None)
+        if tag != FRAME_AUDIO_PCM16 or sample_rate != SAMPLE_RATE or payload % 2:
+            if not self._bad_audio_logged:
+                logger.warning(f"Ignoring audio frames: expected 16-bit PCM at {SAMPLE_RATE} Hz")
+                self._bad_audio_logged = True
+            return
+        if payload == 0:
+            return
             
-        def audio_callback(indata, frames, time_info, status):
-            if status:
-                logger.warning(f"Audio stream status: {status}")
-                
-            if indata.size > 0:
-                audio_chunk = indata[:, 0]  # Take first channel if stereo
-                self.audio_buffer.append(audio_chunk)
-                
-                # Simple VAD (Voice Activity Detection)
-                volume_norm = np.linalg.norm(audio_chunk) / np.sqrt(len(audio_chunk))
-                is_speaking = volume_norm > self.vad_threshold
-                
-                current_time = time.time()
-                
-                if is_speaking:
-                    self.last_audio_time = current_time
-                    self.silence_start_time = None
-                    if not self.audio_buffer.is_recording:
-                        self.audio_buffer.is_recording = True
-                        logger.info("Started recording")
-                elif self.audio_buffer.is_recording:
-                    if self.silence_start_time is None:
-                        self.silence_start_time = current_time
-                    
-                    # If we've had silence for the threshold duration, process the audio
-                    if current_time - self.silence_start_time >= SILENCE_DURATION:
-                        logger.info("End of speech detected, processing...")
-                        asyncio.create_task(self._process_audio())
+        audio_chunk = np.frombuffer(data, dtype=np.int16, offset=_AUDIO_HEADER.size).astype(np.float32)
+        audio_chunk *= 1.0 / 32768.0
+        self._frame_queue.put_nowait(audio_chunk)
+    
+    async def _vad_worker(self):
+        """Buffer incoming audio frames, run VAD and detect the end of speech."""
+        while True:
+            audio_chunk = await self._frame_queue.get()
+            self.audio_buffer.append(audio_chunk)
+            
+            # Energy VAD in dBFS; the mean square is compared against the
+            # threshold converted back to linear, so there is no log per frame
+            is_speaking = frame_energy(audio_chunk) > self._vad_energy_min
+            
+            if is_speaking:
+                self._voiced_frames += 1
+                self._voiced_samples += audio_chunk.shape[0]
+                self._cancel_endpoint()
+                if not self.audio_buffer.is_recording and self._voiced_frames >= VAD_START_FRAMES:
+                    self.audio_buffer.is_recording = True
+                    # Start the utterance at its onset rather than at whatever
+                    # silence or previous speech is still in the ring
+                    preroll = self._voiced_samples + int(VAD_PREROLL * SAMPLE_RATE)
+                    self._commit_ptr = max(self._commit_ptr, self.audio_buffer.write - preroll)
+                    logger.info("Started recording")
+            else:
+                self._voiced_frames = 0
+                self._voiced_samples = 0
+                # If silence lasts for the threshold duration, process the audio;
+                # it also fires if the audio stops arriving altogether
+                if self.audio_buffer.is_recording and self._endpoint_handle is None and not self._endpoint_pending:
+                    self._endpoint_handle = self.loop.call_later(SILENCE_DURATION, self._on_endpoint)
+    
+    def _cancel_endpoint(self):
+        self._endpoint_pending = False
+        if self._endpoint_handle is not None:
+            self._endpoint_handle.cancel()
+            self._endpoint_handle = None
+    
+    def _on_endpoint(self):
+        """Silence timer expired (or the client stopped listening): the utterance is over."""
+        self._endpoint_handle = None
+        if not self._asr_busy.is_set():
+            # Answered once the current reply is done, unless speech resumes
+            self._endpoint_pending = True
+            return
+        logger.info("End of speech detected, processing...")
+        self._start_turn(self._process_audio())
+    
+    def _set_vad_dbfs(self, dbfs: float):
+        """Set the VAD threshold, in dBFS of mean frame energy."""
+        self.vad_dbfs = dbfs
+        self._vad_energy_min = 10.0 ** (dbfs / 10.0)
+    
+    def _uncommitted_start(self) -> int:
+        """First buffer position still to transcribe, keeping at most ASR_WINDOW of audio."""
+        window_start = self.audio_buffer.write - int(ASR_WINDOW * SAMPLE_RATE)
+        return max(self._commit_ptr, window_start, self.audio_buffer.write - self.audio_buffer.count)
+    
+    async def _transcribe_span(self, start: int, end: int, word_timestamps: bool = False) -> Optional[STTResult]:
+        """Transcribe buffer positions [start, end) off the event loop; None if empty or silent."""
+        audio_data = self.audio_buffer.get_span(start, end)
+        if len(audio_data) == 0:
+            return None
+            
+        # Peak from two reductions, no abs() temporary; skip Whisper on silence
+        peak = max(float(audio_data.max()), -float(audio_data.min()))
+        if peak < SILENT_PEAK:
+            return None
+            
+        # Normalize audio into a fresh array: the span is a view into the ring
+        # or its scratch buffer, and Whisper may run after both have moved on
+        audio_data = audio_data * (1.0 / (peak + 1e-5))
         
-        # Start the audio stream
-        self.stream = sd.InputStream(
-            samplerate=SAMPLE_RATE,
-            channels=CHANNELS,
-            callback=audio_callback,
-            blocksize=CHUNK_SIZE,
-            dtype='float32'
+        options = dict(
+            sample_rate=SAMPLE_RATE,
+            language="pt",
+            initial_prompt=ASR_PROMPT,
+            word_timestamps=word_timestamps,
         )
-        self.stream.start()
-        logger.info("Audio stream started")
+        return await run_model(self.stt_engine.transcribe, audio_data, **options)
+    
+    async def _asr_scheduler(self):
+        """Decode the active speech every ASR_INTERVAL and commit its stable prefix."""
+        while True:
+            await asyncio.sleep(ASR_INTERVAL)
+            if not self.audio_buffer.is_recording:
+                continue
+                
+            async with self._asr_lock:
+                if not self.audio_buffer.is_recording:
+                    continue  # End of speech was handled while we waited
+                start = self._uncommitted_start()
+                end = self.audio_buffer.write
+                if end - start < ASR_MIN_AUDIO * SAMPLE_RATE:
+                    continue
+                    
+                try:
+                    result = await self._transcribe_span(start, end, word_timestamps=True)
+                except Exception as e:
+                    logger.error(f"Error in scheduled transcription: {e}")
+                    continue
+                if result is None or not self.audio_buffer.is_recording:
+                    continue
+                    
+                # Commit every word that ended well before the window edge;
+                # later words may still change as more audio arrives
+                stable_until = (end - start) / SAMPLE_RATE - ASR_STABILITY
+                committed = []
+                cut = 0.0
+                for segment in result.segments:
+                    timed = segment["words"] or [{"word": segment["text"], "end": segment["end"]}]
+                    for word in timed:
+                        if word["end"] > stable_until:
+                            break
+                        committed.append(word["word"])
+                        cut = word["end"]
+                    else:
+                        continue
+                    break
+                    
+                if committed:
+                    self._committed_text.append("".join(committed))
+                    self._commit_ptr = start + int(cut * SAMPLE_RATE)
     
     async def _process_audio(self):
         """Process the recorded audio with STT and get a response from the LLM."""
-        if not self.audio_buffer.is_recording:
+        if not self.audio_buffer.is_recording or not self._asr_busy.is_set():
             return
             
+        self._asr_busy.clear()
         self.audio_buffer.is_recording = False
         
         try:
-            # Get the last N seconds of audio (adjust as needed)
-            audio_duration = min(10.0, (self.audio_buffer.end_idx - self.audio_buffer.start_idx) / SAMPLE_RATE)
-            audio_data = self.audio_buffer.get_audio(
-                start_time=0,
-                end_time=audio_duration
-            )
-            
-            if len(audio_data) == 0:
-                logger.warning("No audio data to process")
-                return
+            # Only the tail after the last scheduled commit still needs decoding
+            async with self._asr_lock:
+                start = self._uncommitted_start()
+                end = self.audio_buffer.write
+                if end - start <= 0 and not self._committed_text:
+                    logger.warning("No audio data to process")
+                    return
+                    
+                try:
+                    tail = await self._transcribe_span(start, end)
+                finally:
+                    # Audio up to `end` is consumed; the next utterance may
+                    # already be recording after it, so the buffer is kept
+                    committed, self._committed_text = self._committed_text, []
+                    self._commit_ptr = end
                 
-            # Normalize audio
-            audio_data = audio_data / np.max(np.abs(audio_data) + 1e-5)
-            
-            # Transcribe with STT
-            result = self.stt_engine.transcribe(
-                audio_data,
-                sample_rate=SAMPLE_RATE,
-                language="pt",
-                initial_prompt="Transcrição de voz para uma assistente virtual."
+            parts = committed + ([tail.text] if tail is not None else [])
+            text = " ".join(part.strip() for part in parts if part.strip())
+            result = STTResult(
+                text=text,
+                language=tail.language if tail is not None else "pt",
+                confidence=tail.confidence if tail is not None else 1.0,
+                segments=tail.segments if tail is not None else [],
             )
             
             if not result.text.strip():
@@ -229,12 +448,9 @@ class VTuberWebSocketHandler:
             })
             
             # Process with LLM and get response
-            response_text = await ollama_chat(build_messages(self.current_user_id, result.text, self.memory, self.system_prompt), self.ollama_host, self.ollama_model)
-            
-            # Extract and store facts if applicable
-            fact = maybe_extract_fact(result.text)
-            if fact:
-                self.memory.add_fact(user_id=self.current_user_id, fact=fact)
+            messages = await self._build_messages(result.text)
+            # Speaks each sentence as soon as the LLM finishes it
+            response_text = await self._stream_ollama_reply(messages)
             
             # Send the response text to client
             await self._send_message({
@@ -242,11 +458,8 @@ class VTuberWebSocketHandler:
                 "text": response_text
             })
             
-            # Generate speech with TTS
-            tts_result = self.tts_engine.synthesize(response_text)
-            
-            # Send audio data to client
-            await self._send_audio(tts_result.audio, tts_result.sample_rate)
+            # Extract and store facts if applicable, off the reply path
+            self._store_fact_later(result.text)
             
         except Exception as e:
             logger.error(f"Error processing audio: {e}")
@@ -255,11 +468,23 @@ class VTuberWebSocketHandler:
             except:
                 pass  # Ignore errors if connection is closed
         finally:
-            # Clear the buffer for the next recording
-            self.audio_buffer.clear()
+            self._asr_busy.set()
+            if self._endpoint_pending:
+                self._endpoint_pending = False
+                self._on_endpoint()
+    
+    def _start_turn(self, coro):
+        """Run a reply in a task that cleanup() cancels if the client goes away."""
+        task = asyncio.create_task(coro)
+        self._turn_tasks.add(task)
+        task.add_done_callback(self._turn_tasks.discard)
     
     async def _process_text_message(self, text: str):
         """Process text messages from the input field."""
+        async with self._text_lock:
+            await self._answer_text(text)
+    
+    async def _answer_text(self, text: str):
         try:
             logger.info(f"Processing text message: {text}")
             
@@ -270,32 +495,32 @@ class VTuberWebSocketHandler:
             })
             
             # Process with LLM and get response
+            spoken = False
             try:
+                messages = await self._build_messages(text)
                 if self.llm_provider == "openai":
-                    response_text = await openai_chat(build_messages(self.current_user_id, text, self.memory, self.system_prompt))
+                    response_text = await openai_chat(messages)
                 else:
-                    response_text = await ollama_chat(build_messages(self.current_user_id, text, self.memory, self.system_prompt), self.ollama_host, self.ollama_model)
+                    # Speaks each sentence as soon as the LLM finishes it
+                    response_text = await self._stream_ollama_reply(messages)
+                    spoken = True
             except Exception as llm_error:
                 logger.warning(f"LLM error, using fallback: {llm_error}")
                 # Fallback response when LLM is not available
                 response_text = self._generate_fallback_response(text)
             
-            # Extract and store facts if applicable
-            fact = maybe_extract_fact(text)
-            if fact:
-                self.memory.add_fact(user_id=self.current_user_id, fact=fact)
-            
             # Send the response text to client
             await self._send_message({
                 "type": "response",
                 "text": response_text
             })
             
-            # Generate speech with TTS
-            tts_result = self.tts_engine.synthesize(response_text)
+            # Generate speech with TTS, sending audio as it is synthesized
+            if not spoken:
+                await self._stream_tts(response_text)
             
-            # Send audio data to client
-            await self._send_audio(tts_result.audio, tts_result.sample_rate)
+            # Extract and store facts if applicable, off the reply path
+            self._store_fact_later(text)
             
         except Exception as e:
             logger.error(f"Error processing text message: {e}")
@@ -304,37 +529,157 @@ class VTuberWebSocketHandler:
             except:
                 pass  # Ignore errors if connection is closed
     
+    def _store_fact_later(self, text: str):
+        """Extract a fact from the user's text and store it in a background task."""
+        task = asyncio.create_task(self._extract_and_store(self.current_user_id, text))
+        # Keep a reference until it finishes, the loop only holds weak ones
+        self._fact_tasks.add(task)
+        task.add_done_callback(self._fact_tasks.discard)
+    
+    async def _extract_and_store(self, user_id: str, text: str):
+        try:
+            fact = maybe_extract_fact(text)
+            if fact:
+                await asyncio.to_thread(self.memory.add_fact, user_id, fact)
+        except Exception as e:
+            logger.error(f"Error storing fact: {e}")
+    
+    async def _build_messages(self, text: str) -> List[Dict[str, str]]:
+        """The cached prefix for the current user plus the new user turn.
+
+        The prefix is rebuilt only after a fact is added for the user.
+        """
+        user_id = self.current_user_id
+        generation = self.memory.generation(user_id)
+        cached = self._msg_prefix.get(user_id)
+        if cached is None or cached[0] != generation:
+            prefix = await asyncio.to_thread(build_prefix, user_id, self.memory, self.system_prompt)
+            cached = (generation, prefix)
+            self._msg_prefix[user_id] = cached
+        return cached[1] + [{"role": "user", "content": text}]
+    
+    async def _stream_ollama_reply(self, messages: List[Dict[str, str]]) -> str:
+        """Forward Ollama tokens to the client and speak the reply while it is generated.
+
+        Every completed sentence goes to the speech pipeline right away, so
+        token streaming never waits on TTS. Returns the full reply once all
+        of it has been spoken.
+        """
+        sentences, speech = self._start_speech()
+        parts = []
+        pending = ""
+        try:
+            async for chunk in ollama_chat_stream(messages, self.ollama_host, self.ollama_model):
+                parts.append(chunk)
+                await self._send_message({
+                    "type": "assistant_text_delta",
+                    "text": chunk
+                })
+                
+                pending += chunk
+                cut = None
+                for match in _SENTENCE_BREAK_RE.finditer(pending):
+                    cut = match.end()
+                if cut is not None:
+                    sentences.put_nowait(pending[:cut])
+                    pending = pending[cut:]
+        except BaseException:
+            speech.cancel()
+            raise
+            
+        if pending.strip():
+            sentences.put_nowait(pending)
+        sentences.put_nowait(None)
+        await speech
+        return "".join(parts)
+    
+    def _start_speech(self) -> Tuple[asyncio.Queue, "asyncio.Future[Any]"]:
+        """Start the speech pipeline for one reply.
+
+        Text put on the returned queue is synthesized by one task and sent by
+        another, so sentence k+1 is synthesized while sentence k is still
+        going out. Put None to finish; the future completes once everything
+        queued has been sent.
+        """
+        sentences: asyncio.Queue = asyncio.Queue()
+        audio: asyncio.Queue = asyncio.Queue(maxsize=AUDIO_QUEUE_SIZE)
+        speech = asyncio.gather(self._synthesize_sentences(sentences, audio), self._send_audio_chunks(audio))
+        return sentences, speech
+    
+    async def _synthesize_sentences(self, sentences: asyncio.Queue, audio: asyncio.Queue):
+        """Synthesize queued text in order until the None sentinel, then pass it on."""
+        while True:
+            text = await sentences.get()
+            if text is None:
+                break
+            try:
+                async for chunk in self.tts_engine.synthesize_stream(text):
+                    await audio.put(chunk)
+            except Exception as e:
+                # Keep the reply going; the text already reached the client
+                logger.error(f"Error synthesizing speech: {e}")
+        await audio.put(None)
+    
+    async def _send_audio_chunks(self, audio: asyncio.Queue):
+        """Send synthesized chunks in order until the None sentinel."""
+        while True:
+            chunk = await audio.get()
+            if chunk is None:
+                await self._flush_audio()
+                return
+            await self._send_audio(*chunk)
+    
+    async def _stream_tts(self, text: str):
+        """Speak a complete reply; synthesis runs off the event loop."""
+        sentences, speech = self._start_speech()
+        sentences.put_nowait(text)
+        sentences.put_nowait(None)
+        await speech
+    
     async def _handle_message(self, message: Dict[str, Any]):
         """Handle incoming WebSocket messages."""
         msg_type = message.get("type")
         
         if msg_type == "start_listening":
             self.is_listening = True
-            await self._send_message({"type": "status", "status": "listening"})
+            await self._send_frame(_FRAME_LISTENING)
             
         elif msg_type == "stop_listening":
             self.is_listening = False
-            await self._send_message({"type": "status", "status": "idle"})
+            # No more audio is coming, so don't wait for the silence timer
+            if self.audio_buffer.is_recording:
+                self._cancel_endpoint()
+                self._on_endpoint()
+            await self._send_frame(_FRAME_IDLE)
             
         elif msg_type == "text":
             # Handle text messages from the input field
             text = message.get("text", "").strip()
             if text:
-                await self._process_text_message(text)
+                self._start_turn(self._process_text_message(text))
                 
         elif msg_type == "audio_config":
             # Update audio configuration if needed
-            if "vad_threshold" in message:
-                self.vad_threshold = float(message["vad_threshold"])
+            if "vad_dbfs" in message:
+                self._set_vad_dbfs(float(message["vad_dbfs"]))
+            elif "vad_threshold" in message:
+                # Older clients send a linear RMS threshold
+                self._set_vad_dbfs(20.0 * math.log10(max(float(message["vad_threshold"]), 1e-6)))
+            if "codec" in message:
+                self._set_audio_codec(str(message["codec"]))
                 
         elif msg_type == "ping":
-            await self._send_message({"type": "pong"})
+            await self._send_frame(_FRAME_PONG)
             
     async def _send_message(self, data: Dict[str, Any]):
         """Send a JSON message to the client."""
+        await self._send_frame(_dumps(data))
+    
+    async def _send_frame(self, frame: str):
+        """Send an already serialized JSON message to the client."""
         if self.websocket:
             try:
-                await self.websocket.send_text(json.dumps(data, ensure_ascii=False))
+                await self.websocket.send_text(frame)
             except Exception as e:
                 logger.error(f"Error sending message: {e}")
     
@@ -349,68 +694,78 @@ class VTuberWebSocketHandler:
             logger.error(f"Error sending error message: {e}")
     
     async def _send_audio(self, audio_data: np.ndarray, sample_rate: int):
-        """Send audio data to the client."""
+        """Send int16 TTS audio to the client as tagged binary frames."""
         if self.websocket:
             try:
-                # Convert to 16-bit PCM
-                audio_int16 = (audio_data * 32767).astype(np.int16)
-                await self.websocket.send_bytes(audio_int16.tobytes())
+                if self._opus is not None:
+                    await self._send_opus_packets(self._opus.encode(audio_data, sample_rate))
+                    return
+                header = _AUDIO_HEADER.pack(FRAME_AUDIO_PCM16, sample_rate)
+                await self.websocket.send_bytes(header + audio_data.tobytes())
             except Exception as e:
                 logger.error(f"Error sending audio: {e}")
     
+    async def _flush_audio(self):
+        """Send whatever audio the encoder still holds at the end of a reply."""
+        if self.websocket and self._opus is not None:
+            try:
+                await self._send_opus_packets(self._opus.flush())
+            except Exception as e:
+                logger.error(f"Error sending audio: {e}")
+    
+    async def _send_opus_packets(self, packets: List[bytes]):
+        header = _AUDIO_HEADER.pack(FRAME_AUDIO_OPUS, self._opus.rate)
+        for packet in packets:
+            await self.websocket.send_bytes(header + packet)
+    
+    def _set_audio_codec(self, codec: str):
+        if codec == "opus" and opus_available():
+            if self._opus is None:
+                self._opus = OpusStream()
+        else:
+            if codec == "opus":
+                logger.warning("opuslib not installed, sending PCM audio")
+            self._opus = None
+    
     def _generate_fallback_response(self, user_text: str) -> str:
         """Generate fallback responses when Ollama is not available."""
-        import random
-        
         text_lower = user_text.lower()
         
         # Greeting patterns
-        if any(word in text_lower for word in ['oi', 'ola', 'olá', 'eai', 'e aí']):
-            greetings = [
-                "Oieee! Tudo bem? 😊",
-                "Olá! Que bom conversar com você! 🌸",
-                "E aí! Sumida! 😄",
-                "Oiiee! Como vai? ✨"
-            ]
-            return random.choice(greetings)
+        if _GREETING_RE.search(text_lower):
+            return random.choice(FALLBACK_GREETINGS)
         
         # Question patterns
-        elif '?' in user_text or any(word in text_lower for word in ['qual', 'como', 'onde', 'quando', 'por que']):
-            responses = [
-                "Hmm, boa pergunta! Mas sem o Ollama eu não consigo pensar muito fundo... 🤔",
-                "Nossa, você me pegou! Preciso do meu cérebro AI para responder direito! 🧠",
-                "Essa é difícil! Meu superpoder AI está em manutenção! 😅",
-                "Bom... sem meus superpoderes de IA, fico um pouco limitada! 🤖"
-            ]
-            return random.choice(responses)
+        elif _QUESTION_RE.search(text_lower):
+            return random.choice(FALLBACK_QUESTION_RESPONSES)
         
         # Compliment patterns
-        elif any(word in text_lower for word in ['linda', 'bonita', 'legal', 'gostosa', 'maravilhosa']):
-            responses = [
-                "Awwwn, você é muito gentil! 😊💕",
-                "Nossa, obrigada! Fiquei toda corada! 🌸",
-                "Para de! Você me deixa sem jeito! 😄",
-                "Mashiaaa! Você é o melhor! ✨"
-            ]
-            return random.choice(responses)
+        elif _COMPLIMENT_RE.search(text_lower):
+            return random.choice(FALLBACK_COMPLIMENT_RESPONSES)
         
         # Default responses
         else:
-            responses = [
-                "Legal! Mas sem o Ollama eu não consigo responder muito bem... 😅",
-                "Hmm, interessante! Preciso do meu cérebro AI para conversar direitinho! 🤖",
-                "Nossa, você sabe que sem meu superpoder de IA fico meio limitada? 🤔",
-                "Legal demais! Mas para responder melhor, preciso do Ollama rodando! 🌸"
-            ]
-            return random.choice(responses)
+            return random.choice(FALLBACK_DEFAULT_RESPONSES)
     
     async def cleanup(self):
         """Clean up resources."""
-        if self.stream is not None:
-            self.stream.stop()
-            self.stream.close()
-            self.stream = None
+        if self._vad_task is not None:
+            self._vad_task.cancel()
+            self._vad_task = None
+        
+        if self._asr_task is not None:
+            self._asr_task.cancel()
+            self._asr_task = None
         
+        # Disarm the endpoint first so a cancelled reply doesn't start the next one
+        self._cancel_endpoint()
+        for task in list(self._turn_tasks):
+            task.cancel()
+        await asyncio.gather(*self._turn_tasks, return_exceptions=True)
+        
+        self.websocket = None
         self.audio_buffer.clear()
+        self._commit_ptr = 0
+        self._committed_text = []
         self.is_listening = False
         logger.info("WebSocket handler cleaned up")